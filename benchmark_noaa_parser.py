@@ -0,0 +1,144 @@
+import os
+import glob
+import json
+import time
+import argparse
+import tracemalloc
+import numpy as np
+from src.assistants.analyst.history import parse_publications_file
+
+# Benchmarks the NOAA publication parser on large metadata files saved locally, e.g. the mirror written by
+# `python -m src.assistants.analyst.noaa_metadata`, against the previous split-and-np.unique parser.
+# Without a mirror, synthetic NOAA-style fixtures are generated (see write_synthetic_metadata).
+FIXTURES_DIR = './data/noaa_benchmark_fixtures'
+
+
+def parse_publications_legacy(path, encoding='utf-8'):
+    # The parser used before the streaming one: whole-file split, abstracts built with +=, np.unique over JSON
+    with open(path, 'r', encoding=encoding, errors='replace') as f:
+        lines = f.read().split('\n')
+
+    in_publication_block = False
+    publications = []
+    current_publication = {}
+    abstract_flag = False
+    for line in lines:
+        if line.strip() == '# Publication':
+            in_publication_block = True
+            current_publication = {}
+            abstract_flag = False
+        elif line.strip() == '#--------------------':
+            if in_publication_block and current_publication:
+                publications.append(current_publication)
+                current_publication = {}
+            in_publication_block = False
+        elif in_publication_block:
+            if line.startswith('#   Abstract: '):
+                abstract_flag = True
+                current_publication['Abstract'] = line.split('#   Abstract: ', 1)[1]
+            elif abstract_flag and line != '#':
+                current_publication['Abstract'] += line.split('# ', 1)[1]
+            elif ': ' in line and not abstract_flag:
+                key, value = line.split(': ', 1)
+                key = key.replace('#', '').strip()
+                current_publication[key] = value.strip()
+    if in_publication_block and current_publication:
+        publications.append(current_publication)
+
+    publications_json = [json.dumps(pub, sort_keys=True) for pub in publications]
+    return [json.loads(pub) for pub in np.unique(publications_json)]
+
+
+def write_synthetic_metadata(path, n_publications=3000, n_distinct=600, abstract_lines=50, seed=0):
+    '''
+    Writes a NOAA-style metadata file of n_publications publication blocks for the benchmark.
+
+    Parameters:
+    - path: Output file.
+    - n_publications: Number of publication blocks; at the defaults the file is about 6.8 MB.
+    - n_distinct: The publications repeat after this many blocks, so the duplicate removal has work to do.
+    - abstract_lines: Continuation lines of the abstract of every other publication; the rest have none.
+    - seed: Seed of the random abstract words.
+    '''
+    rng = np.random.default_rng(seed)
+    words = np.array(['fire', 'weather', 'drought', 'fuel', 'moisture', 'wildfire', 'climate', 'regime', 'burn', 'severity'])
+    abstracts = [[' '.join(rng.choice(words, 12)) for _ in range(abstract_lines)] for _ in range(n_distinct)]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('# NOAA\n#--------------------\n')
+        for i in range(n_publications):
+            j = i % n_distinct
+            f.write('# Publication\n'
+                    f'#   Authors: A{j}, B, C\n'
+                    f'#   Published_Date_or_Year: {1990 + j % 30}\n'
+                    f'#   Published_Title: T{j}\n'
+                    '#   Journal_Name: Fire Ecology\n'
+                    f'#   DOI: 10.1/x{j}\n')
+            if j % 2 == 0:
+                f.write('#   Abstract: start.\n')
+                f.writelines(f'# {line}\n' for line in abstracts[j])
+                f.write('#\n')
+            f.write('#--------------------\n')
+    return path
+
+def get_publication_keys(publications):
+    # Order-independent form of a parse result, for comparing the two parsers
+    return sorted(json.dumps(publication, sort_keys=True) for publication in publications)
+
+def benchmark(parser, path, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        publications = parser(path)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    parser(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return publications, min(timings), peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='*', help='Metadata files to parse; defaults to the largest files of the local mirror')
+    parser.add_argument('--cache_dir', default='./data/noaa_metadata_cache')
+    parser.add_argument('--largest', type=int, default=5, help='Number of mirrored files to use when no files are given')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--synthetic', action='store_true', help='Benchmark the synthetic fixtures even if a mirror exists')
+    parser.add_argument('--fixtures_dir', default=FIXTURES_DIR)
+    parser.add_argument('--n_fixtures', type=int, default=3)
+    args = parser.parse_args()
+
+    files = args.files
+    if not files and not args.synthetic:
+        files = sorted(glob.glob(os.path.join(args.cache_dir, '*.txt')), key=os.path.getsize, reverse=True)[:args.largest]
+    if not files:
+        print(f"📦 No metadata files found in {args.cache_dir}; using synthetic fixtures in {args.fixtures_dir}")
+        os.makedirs(args.fixtures_dir, exist_ok=True)
+        files = [os.path.join(args.fixtures_dir, f'synthetic_{seed}.txt') for seed in range(args.n_fixtures)]
+        for seed, path in enumerate(files):
+            if not os.path.exists(path):
+                write_synthetic_metadata(path, seed=seed)
+
+    mismatches = []
+    for path in files:
+        print(f"📄 {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+        results = {}
+        for name, parse in [('legacy', parse_publications_legacy), ('streaming', parse_publications_file)]:
+            try:
+                publications, seconds, peak = benchmark(parse, path, args.repeat)
+                results[name] = get_publication_keys(publications)
+                print(f"   {name:>9}: {seconds * 1000:8.2f} ms, peak memory {peak / 1024 / 1024:6.2f} MB, {len(publications)} publications")
+            except Exception as e:
+                print(f"   {name:>9}: failed ({e})")
+        if len(results) == 2:
+            if results['legacy'] == results['streaming']:
+                print("   ✅ Both parsers return the same publications")
+            else:
+                legacy, streaming = set(results['legacy']), set(results['streaming'])
+                print(f"   ❌ The parsers disagree: {len(legacy - streaming)} publications only from legacy, "
+                      f"{len(streaming - legacy)} only from streaming")
+                mismatches.append(path)
+
+    if mismatches:
+        print(f"❌ The parsers disagree on {len(mismatches)} of {len(files)} files")
@@ -1,12 +1,43 @@
 import geopandas as gpd
-from shapely.geometry import Point
+import os
+import json
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
 import streamlit as st
 import pydeck as pdk
-from src.assistants.analyst.utils import get_pin_layer, MapDisplay
+from src.assistants.analyst.utils import get_pin_layer, MapDisplay, SharedResource, write_atomically
+from src.assistants.analyst.geometry import geodesic_buffer
+
+# The FWI values of interest: every season for the historical, mid-century and end-of-century periods
+FWI_COLUMNS = [
+    'wildfire_spring_Hist', 'wildfire_spring_Midc', 'wildfire_spring_Endc', 
+    'wildfire_summer_Hist', 'wildfire_summer_Midc', 'wildfire_summer_Endc',
+    'wildfire_autumn_Hist', 'wildfire_autumn_Midc', 'wildfire_autumn_Endc',
+    'wildfire_winter_Hist', 'wildfire_winter_Midc', 'wildfire_winter_Endc'
+]
+
+GRID_CELLS_PATH = './data/GridCellsShapefile/GridCells.shp'
+FWI_CSV_PATH = './data/FireWeatherIndex_Wildfire.csv'
+# Binary columns built from the CSV and grid cells by build_fwi_columnar
+FWI_COLUMNAR_DIR = './data/FireWeatherIndex_columnar'
 
 class FWIMapDisplay(MapDisplay):
+    '''
+    Shows the FWI map of the season and period the user selects. Each map is built on first display and
+    memoized in self.map; the built maps are not pickled with the session state, only the grid cell data is.
+    '''
+    def __init__(self, fwi_df_geo, lat, lon):
+        super().__init__({})
+        self.fwi_df_geo = fwi_df_geo
+        self.lat = lat
+        self.lon = lon
+
+    def get_map(self, column_name):
+        if column_name not in self.map:
+            self.map[column_name] = build_fwi_map(self.fwi_df_geo, column_name, self.lat, self.lon)
+        return self.map[column_name]
+
     def display(self):
         col1, col2 = st.columns(2)
         with col1:
@@ -14,14 +45,107 @@ class FWIMapDisplay(MapDisplay):
         with col2:
             period = st.selectbox('Select Period', ['Hist', 'Midc', 'Endc'], index=0)
         if st.button('Display Map'):
-            st.pydeck_chart(self.map[f'wildfire_{season}_{period}'])
+            st.pydeck_chart(self.get_map(f'wildfire_{season}_{period}'))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Sessions saved before the maps were built lazily only have the prebuilt maps, so keep those
+        if 'fwi_df_geo' in state:
+            state['map'] = {}
+        return state
 
 def initialize_data():
-    grid_cells_gdf = gpd.read_file('./data/GridCellsShapefile/GridCells.shp')
+    grid_cells_gdf = gpd.read_file(GRID_CELLS_PATH)
     grid_cells_crs = grid_cells_gdf.crs
-    wildfire_df = pd.read_csv('./data/FireWeatherIndex_Wildfire.csv')
+    wildfire_df = pd.read_csv(FWI_CSV_PATH)
     return grid_cells_gdf, grid_cells_crs, wildfire_df
 
+def get_source_signature():
+    '''
+    Returns the size and modification time of the files the columnar FWI data is built from.
+    '''
+    sources = [FWI_CSV_PATH, GRID_CELLS_PATH, os.path.splitext(GRID_CELLS_PATH)[0] + '.dbf']
+    return {path: [os.path.getsize(path), os.path.getmtime(path)] for path in sources if os.path.exists(path)}
+
+def build_fwi_columnar(output_dir=FWI_COLUMNAR_DIR):
+    '''
+    Converts FireWeatherIndex_Wildfire.csv and the grid cells into compact binary columns that can be
+    memory-mapped at startup instead of parsing the CSV text:
+    - crossmodel.npy: the Crossmodel labels as fixed-width bytes; label i owns row i of fwi.npy
+    - fwi.npy: float32 matrix of the FWI_COLUMNS, one row per Crossmodel
+    - manifest.json: the column names, the grid CRS and the signature of the source files
+    '''
+    grid_cells_gdf, grid_cells_crs, wildfire_df = initialize_data()
+    wildfire_df = wildfire_df.drop_duplicates(subset='Crossmodel')
+
+    os.makedirs(output_dir, exist_ok=True)
+    # Every file is replaced atomically, so workers that have the old fwi.npy memory-mapped keep reading it
+    crossmodels = wildfire_df['Crossmodel'].astype(str).to_numpy()
+    write_atomically(os.path.join(output_dir, 'crossmodel.npy'), lambda f: np.save(f, crossmodels.astype('S')))
+    write_atomically(os.path.join(output_dir, 'fwi.npy'), lambda f: np.save(f, wildfire_df[FWI_COLUMNS].to_numpy(dtype=np.float32)))
+
+    manifest = {
+        'columns': FWI_COLUMNS,
+        'crs': grid_cells_crs.to_wkt(),
+        'rows': len(crossmodels),
+        'sources': get_source_signature()
+    }
+    write_atomically(os.path.join(output_dir, 'manifest.json'), lambda f: f.write(json.dumps(manifest, indent=2).encode('utf-8')))
+    
+    return manifest
+
+def load_fwi_columnar(input_dir=FWI_COLUMNAR_DIR):
+    '''
+    Memory-maps the columns written by build_fwi_columnar, so worker processes share the same pages.
+    Returns the FWI table indexed by Crossmodel, or None if the files are missing or older than their sources.
+    '''
+    manifest_path = os.path.join(input_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    if manifest['sources'] != json.loads(json.dumps(get_source_signature())):
+        print(f"FWI columnar data in {input_dir} is out of date, reading {FWI_CSV_PATH} instead. "
+              "Run `python -m src.assistants.analyst.FWI --build-columnar` to rebuild it.")
+        return None
+
+    crossmodels = np.load(os.path.join(input_dir, 'crossmodel.npy')).astype(str)
+    fwi_values = np.load(os.path.join(input_dir, 'fwi.npy'), mmap_mode='r')
+    # copy=False keeps the DataFrame backed by the memory-mapped file
+    fwi_table = pd.DataFrame(fwi_values, index=pd.Index(crossmodels, name='Crossmodel'), columns=manifest['columns'], copy=False)
+    return fwi_table
+
+def load_fwi_data():
+    '''
+    Loads the grid cells and the FWI table from disk, keying the FWI table by Crossmodel.
+    The FWI table comes from the memory-mapped columnar files when they are up to date, otherwise from the CSV.
+    If a Crossmodel appears more than once, the first row is kept (as the per-cell lookup always did).
+    '''
+    grid_cells_gdf = gpd.read_file(GRID_CELLS_PATH)
+    grid_cells_crs = grid_cells_gdf.crs
+    fwi_table = load_fwi_columnar()
+    if fwi_table is None:
+        wildfire_df = pd.read_csv(FWI_CSV_PATH)
+        fwi_table = wildfire_df.drop_duplicates(subset='Crossmodel').set_index('Crossmodel')
+    # Build the STRtree spatial index over the grid cells now, so the first query does not pay for it
+    grid_cells_gdf.sindex
+    return grid_cells_gdf, grid_cells_crs, fwi_table
+
+# Process-wide FWI data, shared by all sessions instead of re-reading the shapefile and CSV per tool call
+fwi_data = SharedResource(load_fwi_data)
+
+def get_fwi_data():
+    '''
+    Returns (grid_cells_gdf, grid_cells_crs, fwi_table), loading them on first use.
+    '''
+    return fwi_data.get()
+
+def reload_fwi_data():
+    '''
+    Re-reads the FWI data files, e.g. after ./data/GridCellsShapefile or FireWeatherIndex_Wildfire.csv is updated.
+    '''
+    return fwi_data.reload()
+
 def retrieve_crossmodels_within_radius(lat, lon, grid_cells_gdf, grid_cells_crs):
     '''
     Retrieves all Crossmodel indices within a specified radius of a given latitude and longitude.
@@ -36,22 +160,13 @@ def retrieve_crossmodels_within_radius(lat, lon, grid_cells_gdf, grid_cells_crs)
     Returns:
     - A list containing the Crossmodel indices for the grid cells within the specified radius.
     '''
-    # Convert the radius in kilometers to meters (as most CRS use meters)
-    radius_meters = 36 * 1000
-
-    # Create a point from the given latitude and longitude
-    point = Point(lon, lat)
-    point_gseries = gpd.GeoSeries([point], crs="EPSG:4326")  # Assume input is in WGS84
-
-    # Transform the point to match the grid cell CRS
-    point_transformed = point_gseries.to_crs(grid_cells_crs)
+    # The geodesic 36 km circle, in the CRS of the grid cells
+    buffer = geodesic_buffer(lat, lon, 36, crs=grid_cells_crs)
 
-    # Create a buffer around the point in the correct CRS
-    buffer = point_transformed.buffer(radius_meters)
-    buffer = buffer.to_crs(grid_cells_crs)
-
-    # Find grid cells that intersect the buffer area
-    intersecting_cells = grid_cells_gdf[grid_cells_gdf.intersects(buffer.geometry[0])]
+    # Find grid cells that intersect the buffer area: the spatial index looks up candidates by bounding box
+    # and then keeps only those that truly intersect, instead of testing every cell in the grid
+    cell_positions = grid_cells_gdf.sindex.query(buffer, predicate='intersects')
+    intersecting_cells = grid_cells_gdf.iloc[np.sort(cell_positions)]
 
     # Retrieve the Crossmodel indices from the intersecting cells
     crossmodel_indices = intersecting_cells['Crossmodel'].tolist()
@@ -63,66 +178,63 @@ def retrieve_crossmodels_within_radius(lat, lon, grid_cells_gdf, grid_cells_crs)
     
     return intersecting_cells
 
-def get_wildfire_index(wildfire_df, cross_model):
-    wildfire_index = wildfire_df[wildfire_df['Crossmodel'] == cross_model].iloc[0]
-    return wildfire_index
-
-def extract_fwi_values_to_dataframe(wildfire_indices):
+def extract_fwi_values_to_dataframe(fwi_table, cross_models):
     """
-    Extracts and organizes the FWI values for specific seasons and time periods into a pandas DataFrame,
-    focusing only on the specified FWI values to reduce computational complexity.
+    Looks up the FWI values for the given Crossmodels in a single vectorized lookup on the
+    Crossmodel-indexed FWI table, keeping only the seasonal/period FWI columns.
     
     Parameters:
-    - wildfire_indices: Dictionary containing the FWI for each Crossmodel, as obtained from FWI_retrieval function.
+    - fwi_table: FWI table indexed by Crossmodel, as kept in the FWI data store.
+    - cross_models: The Crossmodel identifiers of the grid cells, e.g. from retrieve_crossmodels_within_radius.
     
     Returns:
-    - A pandas DataFrame containing the FWI values for each season and time period across all indices, filtered based on specified FWI values.
+    - A pandas DataFrame with the Crossmodel and the FWI values for each season and time period, one row per Crossmodel.
+      Crossmodels without FWI data are left out.
     """
-    # Define the FWI values of interest
-    fwi_values_all = [
-        'wildfire_spring_Hist', 'wildfire_spring_Midc', 'wildfire_spring_Endc', 
-        'wildfire_summer_Hist', 'wildfire_summer_Midc', 'wildfire_summer_Endc',
-        'wildfire_autumn_Hist', 'wildfire_autumn_Midc', 'wildfire_autumn_Endc',
-        'wildfire_winter_Hist', 'wildfire_winter_Midc', 'wildfire_winter_Endc'
-    ]
-
-    # Initialize a list to hold all rows for the DataFrame
-    data_rows = []
-
-    # Columns for the resulting DataFrame
-    columns = ['Crossmodel'] + fwi_values_all
-    
-    # Iterate over each Crossmodel entry in the wildfire_indices
-    for cross_model, index_values in wildfire_indices.items():
-        # Start with the Crossmodel identifier
-        fwi_values = [cross_model]
-        
-        # Append the FWI values for the specified FWI values
-        fwi_values += [index_values[key] for key in fwi_values_all]
-        
-        # Add the collected FWI values to the data rows
-        data_rows.append(fwi_values)
-
-    # Create a DataFrame from the aggregated data rows
-    fwi_df = pd.DataFrame(data_rows, columns=columns)
+    positions = fwi_table.index.get_indexer(pd.unique(np.asarray(cross_models)))
+    positions = positions[positions >= 0]
+    fwi_df = fwi_table.iloc[positions][FWI_COLUMNS].reset_index()
     
     return fwi_df
 
 
+# Upper bounds (inclusive) of the FWI classes; anything above the last one is Very Extreme
+FWI_CLASS_THRESHOLDS = np.array([9, 21, 34, 39, 53])
+FWI_CLASSES = np.array(['Low', 'Medium', 'High', 'Very High', 'Extreme', 'Very Extreme'])
+FWI_CLASS_RGBA = np.array([
+    [255, 255, 0, 140],  # Yellow for Low
+    [255, 204, 0, 140],  # Light Orange for Medium
+    [255, 153, 0, 140],  # Orange for High
+    [255, 102, 0, 140],  # Dark Orange for Very High
+    [255, 51, 0, 140],   # Red-Orange for Extreme
+    [255, 0, 0, 140]     # Red for Very Extreme
+], dtype=np.uint8)
+FWI_MISSING_LABEL = 'No data'
+FWI_MISSING_RGBA = np.array([128, 128, 128, 140], dtype=np.uint8)  # Gray for NaN FWI values
+
+
+def classify_fwi(values):
+    """
+    Classifies a whole array of FWI values at once.
+    Returns the class labels (array of str) and the RGBA colors (uint8 array of shape (n, 4)).
+    Missing or non-numeric values are labelled FWI_MISSING_LABEL and colored gray.
+    """
+    values = pd.to_numeric(np.ravel(values), errors='coerce').astype(np.float64)
+    missing = np.isnan(values)
+    # right=True makes each threshold inclusive, e.g. 9 is still Low
+    classes = np.digitize(values, FWI_CLASS_THRESHOLDS, right=True)
+    classes[missing] = 0
+
+    labels = FWI_CLASSES[classes].astype(object)
+    labels[missing] = FWI_MISSING_LABEL
+    colors = FWI_CLASS_RGBA[classes]
+    colors[missing] = FWI_MISSING_RGBA
+    return labels, colors
+
+
 def categorize_fwi(value):
     """Categorize the FWI value into its corresponding class and return the value and category."""
-    if value <= 9:
-        return 'Low'
-    elif value <= 21:
-        return 'Medium'
-    elif value <= 34:
-        return 'High'
-    elif value <= 39:
-        return 'Very High'
-    elif value <= 53:
-        return 'Extreme'
-    else:
-        return 'Very Extreme'
+    return classify_fwi([value])[0][0]
 
 fwi_class_colors = {
     'Low': 'rgb(255, 255, 0, 0.5)',
@@ -135,23 +247,40 @@ fwi_class_colors = {
 
 
 def categorize_fwi_color(value):
-    try:
-        if pd.isnull(value):
-            return [128, 128, 128, 140]  # Gray for NaN FWI values
-        elif value <= 9:
-            return [255, 255, 0, 140]  # Yellow for Low
-        elif value <= 21:
-            return [255, 204, 0, 140]  # Light Orange for Medium
-        elif value <= 34:
-            return [255, 153, 0, 140]  # Orange for High
-        elif value <= 39:
-            return [255, 102, 0, 140]  # Dark Orange for Very High
-        elif value <= 53:
-            return [255, 51, 0, 140]  # Red-Orange for Extreme
-        else:
-            return [255, 0, 0, 140]  # Red for Very Extreme
-    except Exception as e:
-        return [128, 128, 128, 140]  # Gray as fallback
+    return classify_fwi([value])[1][0].tolist()
+
+
+def build_fwi_map(fwi_df_geo, column_name, lat, lon):
+    '''
+    Builds the pydeck map of one FWI column (e.g. wildfire_summer_Midc) for the grid cells in fwi_df_geo.
+    '''
+    layer_df = fwi_df_geo[['geometry', 'Crossmodel', column_name]].copy()
+    labels, colors = classify_fwi(layer_df[column_name].to_numpy())
+    layer_df['color'] = colors.tolist()
+    layer_df['classification'] = labels
+
+    view_state = pdk.ViewState(
+        latitude=lat,
+        longitude=lon,
+        zoom=8,
+        pitch=50
+    )
+
+    icon_layer = get_pin_layer(lat, lon)
+
+    layer = pdk.Layer(
+        'GeoJsonLayer',
+        layer_df,
+        opacity=0.8,
+        get_fill_color='color',
+        get_line_color=[255, 0, 0],
+        line_width_min_pixels=1,
+        pickable=True
+    )
+
+    return pdk.Deck(layers=[layer, icon_layer], initial_view_state=view_state, 
+                    tooltip={"text": f"Crossmodel: {{Crossmodel}}. FWI: {{{column_name}}}. Classification: {{classification}}"},
+                    map_style='mapbox://styles/mapbox/light-v10')
 
 
 def FWI_retrieval(lat, lon):
@@ -166,19 +295,12 @@ def FWI_retrieval(lat, lon):
     Returns:
     - A dictionary containing the FWI for each Crossmodel within the specified radius.
     '''
-    grid_cells_gdf, grid_cells_crs, wildfire_df = initialize_data()
+    grid_cells_gdf, grid_cells_crs, fwi_table = get_fwi_data()
     
     # Assuming retrieve_crossmodels_within_radius is already defined
     cross_models = retrieve_crossmodels_within_radius(lat, lon, grid_cells_gdf, grid_cells_crs)
     
-    # Dictionary to hold the wildfire index for each cross model
-    wildfire_indices = {}
-    
-    for cross_model in cross_models['Crossmodel']:
-        wildfire_index = get_wildfire_index(wildfire_df, cross_model)
-        wildfire_indices[cross_model] = wildfire_index
-
-    fwi_df = extract_fwi_values_to_dataframe(wildfire_indices)
+    fwi_df = extract_fwi_values_to_dataframe(fwi_table, cross_models['Crossmodel'])
 
     wildfire_index = fwi_df.iloc[:, 1:].mean()
     wildfire_sd = fwi_df.iloc[:, 1:].std()
@@ -189,20 +311,22 @@ def FWI_retrieval(lat, lon):
     # only keep the data in 2 decimal places
     wildfire_index = {key: round(value, 2) for key, value in wildfire_index.items()}
     wildfire_sd = {key: round(value, 2) for key, value in wildfire_sd.items()}
+    # classify all the averages at once
+    wildfire_class = dict(zip(wildfire_index.keys(), classify_fwi(list(wildfire_index.values()))[0]))
 
     # write a for loop for the output
     output = f"The Fire Weather Index (FWI) for location (lat: {lat}, lon: {lon}) is, reported within a 36 km (22 miles) radius. Historically (1995 - 2004), the FWI is "
     for key, value in wildfire_index.items():
         if key.endswith("Hist"):
-            output += f"{key}: {value}({categorize_fwi(value)}, standard error: {wildfire_sd[key]}), "
+            output += f"{key}: {value}({wildfire_class[key]}, standard error: {wildfire_sd[key]}), "
     output = output[:-2] + ". In the mid-century (2045 - 2054), the FWI is projected to be "
     for key, value in wildfire_index.items():
         if key.endswith("Midc"):
-            output += f"{key}: {value}({categorize_fwi(value)}), "
+            output += f"{key}: {value}({wildfire_class[key]}), "
     output = output[:-2] + ". In the end-of-century (2085 - 2094), the FWI is projected to be "
     for key, value in wildfire_index.items():
         if key.endswith("Endc"):
-            output += f"{key}: {value}({categorize_fwi(value)}), "
+            output += f"{key}: {value}({wildfire_class[key]}), "
     output = output[:-2] + "."
 
     
@@ -212,13 +336,13 @@ def FWI_retrieval(lat, lon):
     fwi_values_with_categories = [[] for _ in range(4)]
     for key, value in wildfire_index.items():
         if 'spring' in key:
-            fwi_values_with_categories[0].append(f"{value} (se: ± {wildfire_sd[key]}) {categorize_fwi(value)}")
+            fwi_values_with_categories[0].append(f"{value} (se: ± {wildfire_sd[key]}) {wildfire_class[key]}")
         elif 'summer' in key:
-            fwi_values_with_categories[1].append(f"{value} (se: ± {wildfire_sd[key]}) {categorize_fwi(value)}")
+            fwi_values_with_categories[1].append(f"{value} (se: ± {wildfire_sd[key]}) {wildfire_class[key]}")
         elif 'autumn' in key:
-            fwi_values_with_categories[2].append(f"{value} (se: ± {wildfire_sd[key]}) {categorize_fwi(value)}")
+            fwi_values_with_categories[2].append(f"{value} (se: ± {wildfire_sd[key]}) {wildfire_class[key]}")
         elif 'winter' in key:
-            fwi_values_with_categories[3].append(f"{value} (se: ± {wildfire_sd[key]}) {categorize_fwi(value)}")
+            fwi_values_with_categories[3].append(f"{value} (se: ± {wildfire_sd[key]}) {wildfire_class[key]}")
     
     data = {
         'FWI Class': ['Low', 'Medium', 'High', 'Very High', 'Extreme', 'Very Extreme'],
@@ -308,41 +432,24 @@ def FWI_retrieval(lat, lon):
     fig2.update_layout(title=f'Explanation each cell in the table above.')
 
     fwi_df_geo = fwi_df_geo.to_crs(epsg=4326)
-    fwi_df_geo = fwi_df_geo[['geometry', 'Crossmodel', 'wildfire_spring_Hist', 'wildfire_spring_Midc', 'wildfire_spring_Endc', 'wildfire_summer_Hist', 'wildfire_summer_Midc', 'wildfire_summer_Endc', 'wildfire_autumn_Hist', 'wildfire_autumn_Midc', 'wildfire_autumn_Endc', 'wildfire_winter_Hist', 'wildfire_winter_Midc', 'wildfire_winter_Endc']]
+    fwi_df_geo = fwi_df_geo[['geometry', 'Crossmodel'] + FWI_COLUMNS]
 
     # round the values to 2 decimal places
     fwi_df_geo = fwi_df_geo.round(2)
 
-    view_state = pdk.ViewState(
-        latitude=lat,
-        longitude=lon,
-        zoom=8,
-        pitch=50
-    )
-    
-    icon_layer = get_pin_layer(lat, lon)
-    
-    maps_dict = {}
-
-    for season in ["spring", "summer", "autumn", "winter"]:
-        for period in ["Hist", "Midc", "Endc"]:
-            column_name = f'wildfire_{season}_{period}'
-            fwi_df_geo['color'] = fwi_df_geo[column_name].apply(categorize_fwi_color)
-            layer = pdk.Layer(
-                'GeoJsonLayer',
-                fwi_df_geo,
-                opacity=0.8,
-                get_fill_color='color',
-                get_line_color=[255, 0, 0],
-                line_width_min_pixels=1,
-                pickable=True
-            )
-            
-            maps_dict[column_name] = pdk.Deck(layers=[layer, icon_layer], initial_view_state=view_state, 
-                        tooltip={"text": f"Crossmodel: {{Crossmodel}}. FWI: {{{column_name}}}. Classification: {categorize_fwi(value)}"},
-                        map_style='mapbox://styles/mapbox/light-v10')
-
-    return output, [f"Fire Weather Index (FWI) Data for Location (lat: {lat}, lon: {lon}) within a 36 km (22 miles) radius, shown at a grid cell level. Select the season and period to view the FWI data. ", FWIMapDisplay(maps_dict)], [legend, fig, fig2]
+    # The maps are built lazily, only for the season and period the user picks
+    maps = FWIMapDisplay(fwi_df_geo, lat, lon)
+
+    return output, [f"Fire Weather Index (FWI) Data for Location (lat: {lat}, lon: {lon}) within a 36 km (22 miles) radius, shown at a grid cell level. Select the season and period to view the FWI data. ", maps], [legend, fig, fig2]
 
 if __name__ == "__main__":
-    print(FWI_retrieval(37.8044, -122.2711))
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--build-columnar', action='store_true', help='Build the binary FWI columns from the CSV and grid cells')
+    args = parser.parse_args()
+
+    if args.build_columnar:
+        manifest = build_fwi_columnar()
+        print(f"Wrote {manifest['rows']} Crossmodels to {FWI_COLUMNAR_DIR}")
+    else:
+        print(FWI_retrieval(37.8044, -122.2711))
\ No newline at end of file
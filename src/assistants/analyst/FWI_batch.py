@@ -0,0 +1,90 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from src.assistants.analyst.FWI import FWI_COLUMNS, get_fwi_data
+from src.assistants.analyst.geometry import geodesic_buffer
+
+
+def FWI_batch_chunk(lats, lons, radius_km=36):
+    '''
+    Computes the FWI summary for one chunk of locations, using the process-wide FWI data and spatial index.
+    See FWI_batch_retrieval for the returned columns.
+    '''
+    grid_cells_gdf, grid_cells_crs, fwi_table = get_fwi_data()
+    n_locations = len(lats)
+
+    # The same geodesic circles as FWI_retrieval, in the grid CRS; geodesic_buffer memoizes them per process
+    buffers = gpd.GeoSeries([geodesic_buffer(lat, lon, radius_km, crs=grid_cells_crs) for lat, lon in zip(lats, lons)],
+                            crs=grid_cells_crs)
+
+    # One bulk spatial index query returns (location, grid cell) pairs for every intersecting cell
+    location_positions, cell_positions = grid_cells_gdf.sindex.query(buffers, predicate='intersects')
+    fwi_rows = fwi_table.index.get_indexer(grid_cells_gdf['Crossmodel'].to_numpy()[cell_positions])
+    found = fwi_rows >= 0
+
+    fwi_df = fwi_table.iloc[fwi_rows[found]][FWI_COLUMNS].reset_index(drop=True).astype(np.float64)
+    fwi_df['location'] = location_positions[found]
+    grouped = fwi_df.groupby('location')
+
+    locations = pd.RangeIndex(n_locations)
+    summary = pd.concat([
+        grouped.size().rename('n_cells').reindex(locations, fill_value=0),
+        grouped.mean().round(2).add_suffix('_mean').reindex(locations),
+        grouped.std().round(2).add_suffix('_sd').reindex(locations)
+    ], axis=1)
+    summary.insert(0, 'lon', lons)
+    summary.insert(0, 'lat', lats)
+    return summary
+
+
+def FWI_batch_retrieval(lats, lons, radius_km=36, workers=1, chunk_size=1000):
+    '''
+    Retrieves the FWI for many locations at once, e.g. to screen substations or parcels, without building
+    any figures or maps.
+
+    Parameters:
+    - lats: Latitudes of the locations.
+    - lons: Longitudes of the locations.
+    - radius_km: The radius in kilometers (geodesic distance, as in FWI_retrieval) around each location to pool
+      grid cells over.
+    - workers: Number of processes; each loads the grid and spatial index once and handles whole chunks.
+    - chunk_size: Number of locations per chunk.
+
+    Returns:
+    - A pandas DataFrame with one row per location, in input order: lat, lon, n_cells (the number of grid cells
+      with FWI data within the radius), and the mean (<column>_mean) and standard error (<column>_sd) of every FWI column.
+    '''
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if len(lats) == 0:
+        return FWI_batch_chunk(lats, lons, radius_km)
+
+    chunks = np.array_split(np.arange(len(lats)), max(1, int(np.ceil(len(lats) / chunk_size))))
+    if workers <= 1:
+        summaries = [FWI_batch_chunk(lats[chunk], lons[chunk], radius_km) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            summaries = list(executor.map(FWI_batch_chunk, [lats[chunk] for chunk in chunks], [lons[chunk] for chunk in chunks], [radius_km] * len(chunks)))
+
+    return pd.concat(summaries, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Summarize the Fire Weather Index (FWI) around every location in a CSV file.')
+    parser.add_argument('input', help='CSV file with one location per row')
+    parser.add_argument('output', help='CSV file to write; the input columns followed by the FWI summary')
+    parser.add_argument('--lat_column', default='lat')
+    parser.add_argument('--lon_column', default='lon')
+    parser.add_argument('--radius_km', type=float, default=36)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--chunk_size', type=int, default=1000)
+    args = parser.parse_args()
+
+    locations = pd.read_csv(args.input)
+    summary = FWI_batch_retrieval(locations[args.lat_column], locations[args.lon_column],
+                                  radius_km=args.radius_km, workers=args.workers, chunk_size=args.chunk_size)
+    summary = pd.concat([locations, summary.drop(columns=['lat', 'lon'])], axis=1)
+    summary.to_csv(args.output, index=False)
+    print(f"Wrote the FWI summary of {len(summary)} locations to {args.output}")
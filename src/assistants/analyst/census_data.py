@@ -0,0 +1,205 @@
+import os
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from census import Census
+from src.assistants.analyst.utils import SharedResource, write_atomically
+from src.assistants.analyst.jurisdiction import get_jurisdictions_within
+from src.assistants.analyst.geometry import geodesic_buffer, get_local_projection, transform_geometry
+
+# Local, pre-projected copies of the census geometries used by the census tool
+CENSUS_DATA_DIR = './data/census'
+TIGER_BLOCK_GROUP_URL = "https://www2.census.gov/geo/tiger/TIGER2022/BG/tl_2022_{state_code}_bg.zip"
+ACS_TABLE_PATH = os.path.join(CENSUS_DATA_DIR, 'acs5_2022_bg.npz')
+ACS_YEAR = 2022
+# C17002_001E: count of ratio of income to poverty in the past 12 months (total)
+# C17002_002E: count of ratio of income to poverty in the past 12 months (< 0.50)
+# C17002_003E: count of ratio of income to poverty in the past 12 months (0.50 - 0.99)
+# B01003_001E: total population
+# B25001_001E: Housing units
+# B19013_001E: Median household income
+# Sources: https://api.census.gov/data/2019/acs/acs5/variables.html
+ACS_VARIABLES = ('C17002_001E', 'C17002_002E', 'C17002_003E', 'B01003_001E', 'B25001_001E', 'B19013_001E')
+# Counts that can be split between the parts of a block group in proportion to area; the median income cannot
+ACS_COUNT_VARIABLES = ('C17002_001E', 'C17002_002E', 'C17002_003E', 'B01003_001E', 'B25001_001E')
+CENSUS_API_KEY = os.getenv("CENSUS_API_KEY", "93c3297165ad8b5b6c81e0ed9e2e44a38e56224f")
+
+# FIPS codes of the 50 states, the District of Columbia and Puerto Rico
+STATE_FIPS = [
+    '01', '02', '04', '05', '06', '08', '09', '10', '11', '12', '13', '15', '16', '17', '18', '19', '20', '21',
+    '22', '23', '24', '25', '26', '27', '28', '29', '30', '31', '32', '33', '34', '35', '36', '37', '38', '39',
+    '40', '41', '42', '44', '45', '46', '47', '48', '49', '50', '51', '53', '54', '55', '56', '72'
+]
+
+
+def get_block_group_path(state_code):
+    return os.path.join(CENSUS_DATA_DIR, f"tl_2022_{state_code}_bg.gpkg")
+
+def build_block_group_store(state_code):
+    '''
+    Downloads the 2022 TIGER block groups of a state, reprojects them to EPSG:4326 once and saves them as a
+    GeoPackage, whose R-tree spatial index get_block_groups_within reads through.
+    '''
+    block_groups = gpd.read_file(TIGER_BLOCK_GROUP_URL.format(state_code=state_code))
+    block_groups = block_groups.to_crs(epsg=4326)
+    block_groups["GEOID"] = block_groups["GEOID"].astype(str)
+    block_groups = block_groups[["GEOID", "ALAND", "AWATER", "geometry"]]
+
+    os.makedirs(CENSUS_DATA_DIR, exist_ok=True)
+    path = get_block_group_path(state_code)
+    write_atomically(path, lambda tmp: block_groups.to_file(tmp.name, driver="GPKG", layer="block_groups"), suffix=".gpkg")
+    return path
+
+def get_block_groups_within(state_code, geometry):
+    '''
+    Returns the block groups of a state that intersect the geometry (in EPSG:4326), building the state's store on
+    first use. The GeoPackage's R-tree selects the block groups in the bounding box of the geometry, so only those
+    are read from disk before the exact intersection test; nothing else of the state is held in memory.
+    '''
+    path = get_block_group_path(state_code)
+    if not os.path.exists(path):
+        build_block_group_store(state_code)
+    candidates = gpd.read_file(path, layer="block_groups", bbox=geometry.bounds)
+    return candidates[candidates.intersects(geometry)].reset_index(drop=True)
+
+def fetch_acs_block_groups(state_code, census=None):
+    '''
+    Downloads the ACS 5-year variables of every block group of a state from the Census API.
+    Returns a DataFrame with a GEOID column and one float column per variable in ACS_VARIABLES.
+    '''
+    census = census or Census(CENSUS_API_KEY)
+    block_groups = census.acs5.state_county_blockgroup(fields=ACS_VARIABLES,
+        state_fips=state_code,
+        county_fips='*',
+        tract='*',
+        blockgroup='*',
+        year=ACS_YEAR)
+    bg_df = pd.DataFrame(block_groups)
+    bg_df["GEOID"] = (bg_df["state"] + bg_df["county"] + bg_df["tract"] + bg_df["block group"]).astype(str)
+    bg_df[list(ACS_VARIABLES)] = bg_df[list(ACS_VARIABLES)].astype(np.float64)
+    return bg_df[["GEOID", *ACS_VARIABLES]]
+
+def build_acs_table(states=STATE_FIPS, output_path=ACS_TABLE_PATH):
+    '''
+    Downloads the ACS 5-year variables of every block group of the given states and saves them as one compact
+    table: the GEOIDs in sorted order and a float matrix with one column per variable in ACS_VARIABLES.
+    '''
+    census = Census(CENSUS_API_KEY)
+    bg_df = pd.concat([fetch_acs_block_groups(state_code, census) for state_code in states], ignore_index=True)
+    bg_df = bg_df.drop_duplicates("GEOID").sort_values("GEOID")
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    write_atomically(output_path, lambda tmp: np.savez(tmp,
+                                                       geoids=bg_df["GEOID"].to_numpy().astype("S12"),
+                                                       values=bg_df[list(ACS_VARIABLES)].to_numpy(dtype=np.float64),
+                                                       variables=np.array(ACS_VARIABLES, dtype="S")))
+    return output_path
+
+def load_acs_table(path=ACS_TABLE_PATH):
+    '''
+    Loads the table written by build_acs_table. Returns (geoids, values), or None if the table has not been
+    built or was built for other variables.
+    '''
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as table:
+        if tuple(table["variables"].astype(str)) != ACS_VARIABLES:
+            return None
+        return table["geoids"], table["values"]
+
+def load_shared_acs_table():
+    # Remembers the modification time of the file it read, so get_acs_values reloads only a changed table
+    global acs_table_mtime
+    acs_table_mtime = os.path.getmtime(ACS_TABLE_PATH) if os.path.exists(ACS_TABLE_PATH) else None
+    return load_acs_table(ACS_TABLE_PATH)
+
+# Process-wide ACS table, shared by all sessions
+acs_table_mtime = None
+acs_table = SharedResource(load_shared_acs_table)
+
+def table_has_state(table_geoids, state_code):
+    # GEOIDs start with the state FIPS code, so the first GEOID not smaller than the code tells
+    position = np.searchsorted(table_geoids, state_code.encode())
+    return position < len(table_geoids) and table_geoids[position].startswith(state_code.encode())
+
+def get_acs_values(state_code, geoids):
+    '''
+    Returns the ACS 5-year variables of the given block groups as a DataFrame with a GEOID column and one column
+    per variable in ACS_VARIABLES. Block groups missing from the data are left out.
+    The values come from the local table; without it, the whole state is requested from the Census API.
+    '''
+    geoids = np.asarray(geoids, dtype=str)
+    table = acs_table.get()
+    if table is None and os.path.exists(ACS_TABLE_PATH) and os.path.getmtime(ACS_TABLE_PATH) != acs_table_mtime:
+        # The table was built, or rebuilt, after this process last read it
+        table = acs_table.reload()
+    if table is None or not table_has_state(table[0], state_code):
+        print(f"The local ACS table has no data for state {state_code}; querying the Census API. Build it with python -m src.assistants.analyst.census_data --acs")
+        bg_df = fetch_acs_block_groups(state_code)
+        return bg_df[bg_df["GEOID"].isin(geoids)].reset_index(drop=True)
+
+    table_geoids, table_values = table
+    # Keyed join on the sorted GEOIDs
+    keys = geoids.astype("S12")
+    positions = np.clip(np.searchsorted(table_geoids, keys), 0, len(table_geoids) - 1)
+    found = table_geoids[positions] == keys
+    bg_df = pd.DataFrame(table_values[positions[found]], columns=ACS_VARIABLES)
+    bg_df.insert(0, "GEOID", geoids[found])
+    return bg_df
+
+def aggregate_census(lat, lon, radius_km=36):
+    '''
+    Estimates the ACS counts within radius_km (geodesic) of a location. Block groups crossing the circle are
+    counted in proportion to the share of their area inside it.
+
+    Parameters:
+    - lat: Latitude of the location.
+    - lon: Longitude of the location.
+    - radius_km: The radius of the circle in kilometers.
+
+    Returns:
+    - A GeoDataFrame (EPSG:4326) of the block groups intersecting the circle, in every state it reaches, with the
+      ACS variables and the 'area_fraction' of each block group inside the circle.
+    - A pandas Series with the area-weighted totals of ACS_COUNT_VARIABLES and of 'poverty_count'
+      (C17002_002E + C17002_003E).
+    '''
+    buffer = geodesic_buffer(lat, lon, radius_km)
+    # The same circle in the azimuthal equidistant projection centred on the location, where areas are measured
+    local_crs = get_local_projection(lat, lon)
+    circle = geodesic_buffer(lat, lon, radius_km, crs=local_crs)
+
+    # Candidate block groups from the spatial index of every state the circle reaches into
+    state_codes = [state['GEOID'] for state in get_jurisdictions_within(buffer, level='state')]
+    block_groups = [get_block_groups_within(state_code, buffer) for state_code in state_codes]
+    block_groups = [bg_df.merge(get_acs_values(state_code, bg_df["GEOID"]), on="GEOID")
+                    for state_code, bg_df in zip(state_codes, block_groups) if len(bg_df) > 0]
+    if block_groups:
+        bg_df = gpd.GeoDataFrame(pd.concat(block_groups, ignore_index=True), crs="EPSG:4326")
+    else:
+        bg_df = gpd.GeoDataFrame(columns=["GEOID", *ACS_VARIABLES, "geometry"], geometry="geometry", crs="EPSG:4326")
+
+    # Vectorized overlay in the local projection: area of each block group and of its part inside the circle
+    local_geometries = transform_geometry(bg_df.geometry.to_numpy(), "EPSG:4326", local_crs)
+    areas = shapely.area(local_geometries)
+    inside_areas = shapely.area(shapely.intersection(local_geometries, circle))
+    bg_df["area_fraction"] = np.divide(inside_areas, areas, out=np.zeros(len(bg_df)), where=areas > 0).clip(0, 1)
+
+    counts = bg_df[list(ACS_COUNT_VARIABLES)].astype(np.float64)
+    totals = counts.mul(bg_df["area_fraction"], axis=0).sum()
+    totals["poverty_count"] = totals["C17002_002E"] + totals["C17002_003E"]
+    return bg_df, totals
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the local census geometry store used by the census tool.")
+    parser.add_argument("--states", nargs="*", default=STATE_FIPS, help="State FIPS codes; all states by default")
+    parser.add_argument("--acs", action="store_true", help="Build the ACS table instead of the block group geometries")
+    args = parser.parse_args()
+
+    if args.acs:
+        print(f"📦 ACS {ACS_YEAR} 5-year table of {len(args.states)} states -> {build_acs_table(args.states)}")
+    else:
+        for state_code in args.states:
+            print(f"📦 Block groups of state {state_code} -> {build_block_group_store(state_code)}")
@@ -0,0 +1,58 @@
+from functools import lru_cache
+import numpy as np
+import pyproj
+import shapely
+from shapely.geometry import Point
+
+# Buffers are memoized by their centre rounded to this many decimals (1e-5 degrees is about a metre) and their
+# radius rounded to the metre
+BUFFER_DECIMALS = 5
+# Segments per quarter circle of a buffer; the default of 16 makes the polygon up to 0.5% smaller than the circle
+BUFFER_QUAD_SEGS = 64
+BUFFER_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=256)
+def get_transformer(source_crs, target_crs):
+    '''
+    Returns a cached pyproj Transformer between two CRS (anything pyproj.CRS accepts and is hashable), with
+    coordinates in (x, y) = (lon, lat) order. Creating a transformer is far more expensive than using one.
+    '''
+    return pyproj.Transformer.from_crs(source_crs, target_crs, always_xy=True)
+
+def get_local_projection(lat, lon):
+    '''
+    Returns the azimuthal equidistant projection centred on a location: distances from the centre (in meters)
+    are exact geodesic distances on the WGS84 ellipsoid.
+    '''
+    return f"+proj=aeqd +ellps=WGS84 +units=m +lat_0={lat} +lon_0={lon}"
+
+def transform_geometry(geometry, source_crs, target_crs):
+    '''
+    Reprojects a shapely geometry (or array of geometries) with a cached transformer, all coordinates at once.
+    '''
+    transformer = get_transformer(source_crs, target_crs)
+    def transform_coordinates(coordinates):
+        x, y = transformer.transform(coordinates[:, 0], coordinates[:, 1])
+        return np.column_stack([x, y])
+    return shapely.transform(geometry, transform_coordinates)
+
+@lru_cache(maxsize=BUFFER_CACHE_SIZE)
+def get_geodesic_buffer(lat, lon, radius_m, crs):
+    circle = Point(0, 0).buffer(radius_m, quad_segs=BUFFER_QUAD_SEGS)
+    return transform_geometry(circle, get_local_projection(lat, lon), crs)
+
+def geodesic_buffer(lat, lon, radius_km, crs="EPSG:4326"):
+    '''
+    Returns the circle of all points within radius_km (geodesic distance) of a location as a shapely polygon
+    in the given CRS. Every tool builds its search area here, so "within 36 km" means the same everywhere.
+    Buffers are memoized, so repeated calls for the same location are free.
+
+    Parameters:
+    - lat: Latitude of the location.
+    - lon: Longitude of the location.
+    - radius_km: The radius in kilometers.
+    - crs: The CRS of the returned polygon, e.g. the CRS of the data it is intersected with.
+    '''
+    return get_geodesic_buffer(round(float(lat), BUFFER_DECIMALS), round(float(lon), BUFFER_DECIMALS),
+                               round(float(radius_km) * 1000), crs)
@@ -1,9 +1,8 @@
-from geopy.distance import geodesic
 import numpy as np
 import pandas as pd
-import requests
-from src.assistants.analyst.utils import get_pin_layer, MapDisplay
-import json
+from sklearn.neighbors import BallTree
+from src.assistants.analyst.utils import get_pin_layer, MapDisplay, SharedResource, EARTH_RADIUS_KM, GEODESIC_MARGIN_KM, wgs84_geod
+from src.assistants.analyst.noaa_metadata import get_parsed_metadata, map_concurrently
 import pydeck as pdk
 
 def format_apa_citation(publication):
@@ -65,98 +64,132 @@ def extract_abstract_and_citation(publications):
     return publication_details
 
 
-def get_publications(url):
+def add_publication(publications, seen, publication, abstract_parts):
+    # The abstract is collected in parts and joined once the publication is complete
+    if abstract_parts is not None:
+        publication['Abstract'] = ''.join(abstract_parts)
+    # Duplicates are detected on a canonical key: the sorted (field, value) pairs
+    key = tuple(sorted(publication.items()))
+    if key not in seen:
+        seen.add(key)
+        publications.append(publication)
+
+def parse_publications(lines):
     '''
-    Downloads the file from the given URL and parses it to extract the publication details.
-    Returns a list of dictionaries containing the publication details.
+    Parses the publications out of the lines of a NOAA metadata file in a single pass and returns the unique ones
+    (first occurrence kept), as a list of dictionaries.
+    lines can be any iterable of str without line endings, e.g. a file being read or response.iter_lines(decode_unicode=True),
+    so the file never has to be held in memory as a whole.
+    '''
+    publications = []
+    seen = set()
+
+    # Flag to indicate if we are currently reading a publication block
+    in_publication_block = False
+
+    # Temporary dictionary to hold the current publication's details, and the parts of its abstract
+    current_publication = {}
+    abstract_parts = None
+
+    for line in lines:
+        # Check for the start of a publication block
+        if line.strip() == '# Publication':
+            in_publication_block = True
+            current_publication = {}
+            abstract_parts = None
+        elif line.strip() == '#--------------------':
+            # End of a publication block
+            if in_publication_block and current_publication:
+                add_publication(publications, seen, current_publication, abstract_parts)
+                current_publication = {}
+            in_publication_block = False
+        elif in_publication_block:
+            # Process the publication details
+            if line.startswith('#   Abstract: '):
+                current_publication['Abstract'] = ''
+                abstract_parts = [line.split('#   Abstract: ', 1)[1]]
+            elif abstract_parts is not None and line != '#':
+                # Continue appending to the abstract
+                abstract_parts.append(line.split('# ', 1)[1] if '# ' in line else line.lstrip('#'))
+            elif ': ' in line and abstract_parts is None:
+                key, value = line.split(': ', 1)
+                key = key.replace('#', '').strip()
+                current_publication[key] = value.strip()
+
+    # Ensuring the last publication is added if the file doesn't end with the separator
+    if in_publication_block and current_publication:
+        add_publication(publications, seen, current_publication, abstract_parts)
+
+    return publications
+
+def parse_publications_file(path, encoding='utf-8'):
+    '''
+    Parses a NOAA metadata file line by line and returns the unique publications in it, as a list of dictionaries.
     
-    :param url: URL of the file to download
-    :return: List of dictionaries containing the publication details
+    :param path: Path of the downloaded metadata file
+    :param encoding: Text encoding of the file
+    :return: List of dictionaries containing the raw publication fields
     '''
-
-    # Attempting to download and read the content of the file
     try:
-        response = requests.get(url)
-        # Checking if the request was successful
-        if response.status_code == 200:
-            data_content = response.text
-        else:
-            data_content = f"Failed to download the data. Status code: {response.status_code}"
+        with open(path, 'r', encoding=encoding, errors='replace') as f:
+            return parse_publications(line.rstrip('\r\n') for line in f)
     except Exception as e:
-        data_content = f"An error occurred: {e}"
+        print(f"An error occurred while parsing {path}: {e}")
+        return []
 
 
-    try:
-        file_contents = data_content
-
-        # Splitting the file content into lines for easier processing
-        lines = file_contents.split('\n')
-
-        # Flag to indicate if we are currently reading a publication block
-        in_publication_block = False
-
-        # List to store all publication dictionaries
+def get_publications(url):
+    '''
+    Gets the metadata file of the given URL (from the local mirror when possible) and extracts the publication details.
+    Returns a list of dictionaries containing the publication details.
+    
+    :param url: URL of the metadata file
+    :return: List of dictionaries containing the publication details
+    '''
+    # The file is only downloaded if it is not mirrored yet or its cache entry expired, and parsed once per content
+    publications = get_parsed_metadata(url, parse_publications_file)
+    if publications is None:
         publications = []
-
-        # Temporary dictionary to hold the current publication's details
-        current_publication = {}
-        abstract_flag = False
-
-        # Iterating over each line
-        for line in lines:
-            # Check for the start of a publication block
-            if line.strip() == '# Publication':
-                in_publication_block = True
-                current_publication = {}
-                abstract_flag = False
-            elif line.strip() == '#--------------------':
-                # End of a publication block
-                if in_publication_block and current_publication:
-                    publications.append(current_publication)
-                    current_publication = {}
-                in_publication_block = False
-            elif in_publication_block:
-                # Process the publication details
-                if line.startswith('#   Abstract: '):
-                    abstract_flag = True
-                    current_publication['Abstract'] = line.split('#   Abstract: ', 1)[1]
-                elif abstract_flag and line != '#':
-                    # Continue appending to the abstract
-                    current_publication['Abstract'] += line.split('# ', 1)[1]
-                elif ': ' in line and not abstract_flag:
-                    key, value = line.split(': ', 1)
-                    key = key.replace('#', '').strip()
-                    current_publication[key] = value.strip()
-
-        # Ensuring the last publication is added if the file doesn't end with the separator
-        if in_publication_block and current_publication:
-            publications.append(current_publication)
-
-    except Exception as e:
-        publications = f"An error occurred: {e}"
-
-    publications_json = [json.dumps(pub, sort_keys=True) for pub in publications]
-
-    # Use np.unique to get unique JSON strings
-    unique_publications_json = np.unique(publications_json)
-    publications = [json.loads(pub) for pub in unique_publications_json]
     
     publication_details = extract_abstract_and_citation(publications)
     return publication_details
 
 
-# Re-defining the functions and re-loading the data as the code execution state was reset
+FIRE_HISTORY_PATH = './data/s1-NAFSS.csv'
+
+def load_fire_history_sites():
+    '''
+    Loads the NOAA fire history sites and builds a BallTree over their coordinates (haversine metric, in radians).
+    '''
+    fire_data = pd.read_csv(FIRE_HISTORY_PATH)
+    fire_data = fire_data.dropna(subset=['latitude', 'longitude']).reset_index(drop=True)
+    tree = BallTree(np.radians(fire_data[['latitude', 'longitude']].to_numpy()), metric='haversine')
+    return fire_data, tree
+
+# The sites are static, so the table and its tree are built once per process and shared by all sessions
+fire_history_sites = SharedResource(load_fire_history_sites)
+
+def find_nearest_fire_history_sites(lat, lon, max_distance_km=36, k=3):
+    '''
+    Returns the k fire history sites closest to (lat, lon) within max_distance_km, sorted by geodesic distance,
+    with that distance in a 'distance' column.
+    '''
+    fire_data, tree = fire_history_sites.get()
+    # The tree returns the sites within the radius by great-circle distance (plus a margin for the ellipsoid),
+    # which are then measured exactly
+    candidates = tree.query_radius(np.radians([[lat, lon]]), r=(max_distance_km + GEODESIC_MARGIN_KM) / EARTH_RADIUS_KM)[0]
+    nearby_records = fire_data.iloc[candidates].copy()
+    _, _, distances = wgs84_geod.inv(np.full(len(candidates), lon), np.full(len(candidates), lat),
+                                     nearby_records['longitude'].to_numpy(), nearby_records['latitude'].to_numpy())
+    nearby_records['distance'] = distances / 1000
+    return nearby_records[nearby_records['distance'] <= max_distance_km].sort_values(by='distance')[:k]
 
 def long_term_fire_history_records(lat, lon, max_distance_km = 36):
     """
     Finds the 3 closest fire history records to the given latitude and longitude within 36 km.
     Returns a list of dictionaries of the fire history data, up to a maximum of max_results records.
     """
-    fire_data = pd.read_csv('./data/s1-NAFSS.csv')
-    distances = fire_data.apply(lambda row: geodesic((lat, lon), (row['latitude'], row['longitude'])).kilometers, axis=1)
-    print(distances)
-    fire_data['distance'] = distances
-    nearby_records = fire_data[fire_data['distance'] <= max_distance_km].sort_values(by='distance')[:3]
+    nearby_records = find_nearest_fire_history_sites(lat, lon, max_distance_km)
     
     aggregation_functions = {
         'siteName': list,
@@ -167,12 +200,17 @@ def long_term_fire_history_records(lat, lon, max_distance_km = 36):
     }
 
     combined_records = nearby_records.groupby('reference').agg(aggregation_functions).reset_index().to_dict('records')
+    urls = []
     for record in combined_records:
         url = record['link_to_metadata']
         # if url is a list, take the first one
         if isinstance(url, list):
             url = url[0]
-        record['publications'] = get_publications(url)
+        urls.append(url)
+
+    # Fetch the metadata of all the references at once; the results come back in the order of the records
+    for record, publications in zip(combined_records, map_concurrently(get_publications, urls)):
+        record['publications'] = publications
 
     if not combined_records:
         return "No fire history records found within 36 km of the given location. This only means that we do not find research data from NOAA''s fire history and paleoclimate services. Please inform your client of this limitation. If you haven't analyzed the FWI data or the recent fire incident data, ask if your client would like to explore alternative sources for analysis, such as the Fire Weather Index (FWI) or recent fire incident data; otherwise, suggest your client to proceed with the plan.", None, []
@@ -1,28 +1,244 @@
+import os
+import json
 import pandas as pd
+import numpy as np
 import plotly.subplots as sp
 import plotly.graph_objects as go
 import pydeck as pdk
-from src.assistants.analyst.utils import get_pin_layer, MapDisplay
+from src.assistants.analyst.utils import get_pin_layer, MapDisplay, SharedResource, bounding_box, haversine_km, points_within_radius, write_atomically, GEODESIC_MARGIN_KM
 
+INCIDENT_SOURCE_PATH = "./data/Wildland_Fire_Incident_Locations.csv"
+INCIDENT_PRUNED_PATH = "./data/Wildland_Fire_Incident_Locations_pruned.csv"
+# Per-year binary partitions and their bucket index, written by prune_data
+INCIDENT_PARTITION_DIR = "./data/Wildland_Fire_Incident_Locations_partitioned"
 
-def prune_data(source_file = "./data/Wildland_Fire_Incident_Locations.csv"):
-    data = pd.read_csv(source_file)
-    data = data[["X", "Y", "IncidentTypeCategory", "FireDiscoveryDateTime"]]
-    # change DateTime to year, month
-    data["FireDiscoveryDateTime"] = pd.to_datetime(data["FireDiscoveryDateTime"])
-    data["year"] = data["FireDiscoveryDateTime"].dt.year
-    data["month"] = data["FireDiscoveryDateTime"].dt.month
-    data = data[data["IncidentTypeCategory"] == "WF"]
-    # change X to lon, Y to lat
-    data = data[["X", "Y", "year", "month"]]
-    data.columns = ["lon", "lat", "year", "month"]
-    data.to_csv("./data/Wildland_Fire_Incident_Locations_pruned.csv", index=False)
+# Compact in-memory layout of the incidents: float32 coordinates, int16 year and int8 month
+INCIDENT_DTYPE = np.dtype([('lon', np.float32), ('lat', np.float32), ('year', np.int16), ('month', np.int8)])
 
+# Incidents are bucketed on a regular lat/lon grid; bucket id = row * INCIDENT_BUCKET_COLUMNS + column
+INCIDENT_BUCKET_DEGREES = 0.1
+INCIDENT_BUCKET_COLUMNS = int(round(360 / INCIDENT_BUCKET_DEGREES))
+INCIDENT_BUCKET_ROWS = int(round(180 / INCIDENT_BUCKET_DEGREES))
 
-import pandas as pd
-from geopy.distance import geodesic
 
-def extract_historical_fire_data(lat, lon, start_year=2015, end_year=2023, source_file="./data/Wildland_Fire_Incident_Locations_pruned.csv"):
+def get_bucket_rows_and_columns(lats, lons):
+    rows = np.floor((np.asarray(lats, dtype=np.float64) + 90) / INCIDENT_BUCKET_DEGREES).astype(np.int32)
+    columns = np.floor((np.asarray(lons, dtype=np.float64) + 180) / INCIDENT_BUCKET_DEGREES).astype(np.int32)
+    return np.clip(rows, 0, INCIDENT_BUCKET_ROWS - 1), columns % INCIDENT_BUCKET_COLUMNS
+
+def get_bucket_ids(lats, lons):
+    rows, columns = get_bucket_rows_and_columns(lats, lons)
+    return rows * INCIDENT_BUCKET_COLUMNS + columns
+
+def build_incident_partition(incidents):
+    '''
+    Sorts one year of incidents (an INCIDENT_DTYPE array) by bucket and indexes the buckets.
+    Returns a dict with the sorted 'incidents', the non-empty 'bucket_ids' in ascending order, 'bucket_offsets'
+    such that the incidents of bucket_ids[i] are incidents[bucket_offsets[i]:bucket_offsets[i + 1]], and
+    'bucket_counts', the number of incidents of bucket_ids[i] in each month (shape (len(bucket_ids), 12)).
+    '''
+    buckets = get_bucket_ids(incidents['lat'], incidents['lon'])
+    order = np.argsort(buckets, kind='stable')
+    bucket_ids, bucket_starts, bucket_positions = np.unique(buckets[order], return_index=True, return_inverse=True)
+    return {
+        'incidents': incidents[order],
+        'bucket_ids': bucket_ids.astype(np.int32),
+        'bucket_offsets': np.append(bucket_starts, len(order)).astype(np.int64),
+        'bucket_counts': count_bucket_months(bucket_positions, incidents['month'][order], len(bucket_ids))
+    }
+
+def count_bucket_months(bucket_positions, months, n_buckets):
+    '''
+    Counts the incidents per bucket and month; bucket_positions are the positions of the incidents' buckets in bucket_ids.
+    '''
+    counts = np.bincount(np.asarray(bucket_positions, dtype=np.int64) * 12 + (np.asarray(months, dtype=np.int64) - 1), minlength=n_buckets * 12)
+    return counts.reshape(n_buckets, 12).astype(np.int32)
+
+def to_incident_records(data):
+    '''
+    Converts a DataFrame with lon, lat, year and month columns (and no missing values) to an INCIDENT_DTYPE array.
+    '''
+    incidents = np.empty(len(data), dtype=INCIDENT_DTYPE)
+    for column in INCIDENT_DTYPE.names:
+        incidents[column] = data[column].to_numpy()
+    return incidents
+
+def prune_data(source_file=INCIDENT_SOURCE_PATH, output_dir=INCIDENT_PARTITION_DIR, pruned_file=INCIDENT_PRUNED_PATH, chunksize=500000):
+    '''
+    Streams the raw incident file in chunks, keeps the wildfires (WF) and writes
+    - the pruned CSV with lon, lat, year and month, unless pruned_file is None, and
+    - one compact partition per year with its spatial bucket index to output_dir (see write_incident_partitions).
+    Only the needed columns are parsed, and the incidents are kept as INCIDENT_DTYPE records between chunks.
+    '''
+    yearly_incidents = {}
+    reader = pd.read_csv(source_file, usecols=["X", "Y", "IncidentTypeCategory", "FireDiscoveryDateTime"],
+                         dtype={"IncidentTypeCategory": "category"}, chunksize=chunksize)
+    for i, data in enumerate(reader):
+        data = data[data["IncidentTypeCategory"] == "WF"]
+        # change DateTime to year, month and X to lon, Y to lat
+        discovery = pd.to_datetime(data["FireDiscoveryDateTime"], errors="coerce")
+        data = pd.DataFrame({"lon": data["X"], "lat": data["Y"], "year": discovery.dt.year, "month": discovery.dt.month})
+        if pruned_file:
+            data.to_csv(pruned_file, mode="w" if i == 0 else "a", header=(i == 0), index=False)
+
+        incidents = to_incident_records(data.dropna())
+        for year in np.unique(incidents["year"]):
+            yearly_incidents.setdefault(int(year), []).append(incidents[incidents["year"] == year])
+
+    partitions = {year: build_incident_partition(np.concatenate(chunks)) for year, chunks in yearly_incidents.items()}
+    write_incident_partitions(partitions, output_dir, source_file)
+    return partitions
+
+def get_source_signature(source_file=INCIDENT_SOURCE_PATH):
+    '''
+    Returns the size and modification time of the raw incident file the partitions are built from.
+    '''
+    return {source_file: [os.path.getsize(source_file), os.path.getmtime(source_file)]} if os.path.exists(source_file) else {}
+
+def write_incident_partitions(partitions, output_dir=INCIDENT_PARTITION_DIR, source_file=INCIDENT_SOURCE_PATH):
+    '''
+    Writes each year's partition as incidents_<year>.npy (INCIDENT_DTYPE records sorted by bucket) with its bucket index
+    bucket_ids_<year>.npy and bucket_offsets_<year>.npy, the monthly counts per bucket bucket_counts_<year>.npy,
+    followed by a manifest.json describing the layout and the signature of the raw source_file.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    # Every file is replaced atomically, so processes that have the old partitions memory-mapped keep reading them
+    for year, partition in partitions.items():
+        for name in ["incidents", "bucket_ids", "bucket_offsets", "bucket_counts"]:
+            write_atomically(os.path.join(output_dir, f"{name}_{year}.npy"), lambda f: np.save(f, partition[name]))
+
+    manifest = {
+        "years": sorted(partitions),
+        "counts": {str(year): len(partition["incidents"]) for year, partition in partitions.items()},
+        "bucket_degrees": INCIDENT_BUCKET_DEGREES,
+        "dtype": [list(field) for field in INCIDENT_DTYPE.descr],
+        "sources": get_source_signature(source_file)
+    }
+    write_atomically(os.path.join(output_dir, "manifest.json"), lambda f: f.write(json.dumps(manifest, indent=2).encode("utf-8")))
+
+def read_incident_partitions(input_dir=INCIDENT_PARTITION_DIR):
+    '''
+    Memory-maps the partitions written by write_incident_partitions. Returns None if they have not been built.
+    A warning is printed if the raw incident file changed since; the partitions are still used, as the pruned CSV
+    comes from the same prune run. Deployments without the raw file skip the check.
+    '''
+    manifest_path = os.path.join(input_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    for source_file, signature in manifest.get("sources", {}).items():
+        if os.path.exists(source_file) and get_source_signature(source_file)[source_file] != signature:
+            print(f"Incident partitions in {input_dir} are older than {source_file}. "
+                  "Run `python -m src.assistants.analyst.incident --prune` to rebuild them.")
+
+    partitions = {}
+    for year in manifest["years"]:
+        incidents = np.load(os.path.join(input_dir, f"incidents_{year}.npy"), mmap_mode="r")
+        if manifest["bucket_degrees"] != INCIDENT_BUCKET_DEGREES:
+            # The bucket grid changed since the files were written, so index the incidents again
+            partitions[year] = build_incident_partition(np.asarray(incidents))
+            continue
+        partition = {
+            "incidents": incidents,
+            "bucket_ids": np.load(os.path.join(input_dir, f"bucket_ids_{year}.npy")),
+            "bucket_offsets": np.load(os.path.join(input_dir, f"bucket_offsets_{year}.npy")),
+            "bucket_counts": np.load(os.path.join(input_dir, f"bucket_counts_{year}.npy"))
+        }
+        partitions[year] = partition
+    return partitions
+
+def load_incident_partitions(source_file=INCIDENT_PRUNED_PATH):
+    '''
+    Loads the incidents partitioned by year. Returns a dict of year -> partition (see build_incident_partition).
+    The binary partitions written by prune_data are used when present, otherwise the pruned CSV is read.
+    '''
+    if source_file == INCIDENT_PRUNED_PATH:
+        partitions = read_incident_partitions()
+        if partitions is not None:
+            return partitions
+
+    data = pd.read_csv(source_file, usecols=["lon", "lat", "year", "month"]).dropna()
+    incidents = to_incident_records(data)
+
+    return {int(year): build_incident_partition(incidents[incidents['year'] == year]) for year in np.unique(incidents['year'])}
+
+# Process-wide incident index, shared by all sessions instead of re-reading the CSV per tool call
+incident_data = SharedResource(load_incident_partitions)
+
+def get_candidate_buckets(partition, lat, lon, radius_km):
+    '''
+    Returns the positions (in partition['bucket_ids']) of the non-empty buckets that overlap the bounding box of the
+    circle of radius_km around (lat, lon).
+    '''
+    min_lat, max_lat, delta_lon = bounding_box(lat, lon, radius_km)
+    min_row, max_row = get_bucket_rows_and_columns([min_lat, max_lat], [lon, lon])[0]
+    if delta_lon is None or 2 * delta_lon >= 360 - INCIDENT_BUCKET_DEGREES:
+        column_ranges = [(0, INCIDENT_BUCKET_COLUMNS - 1)]
+    else:
+        first_column, last_column = get_bucket_rows_and_columns([lat, lat], [lon - delta_lon, lon + delta_lon])[1]
+        if first_column <= last_column:
+            column_ranges = [(first_column, last_column)]
+        else:
+            # The box crosses the antimeridian
+            column_ranges = [(first_column, INCIDENT_BUCKET_COLUMNS - 1), (0, last_column)]
+
+    rows = np.arange(min_row, max_row + 1)
+    positions = []
+    for first_column, last_column in column_ranges:
+        # The buckets of one row between two columns are consecutive ids, so they are one range of positions
+        starts = np.searchsorted(partition['bucket_ids'], rows * INCIDENT_BUCKET_COLUMNS + first_column, side='left')
+        ends = np.searchsorted(partition['bucket_ids'], rows * INCIDENT_BUCKET_COLUMNS + last_column, side='right')
+        positions += [np.arange(start, end) for start, end in zip(starts, ends) if end > start]
+    if not positions:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(positions)
+
+def get_bucket_incidents(partition, bucket_positions):
+    '''
+    Returns the incidents of the given buckets, reading only their slices of the (possibly memory-mapped) partition.
+    '''
+    starts = partition['bucket_offsets'][bucket_positions]
+    lengths = partition['bucket_offsets'][bucket_positions + 1] - starts
+    # Index of every incident in the buckets: each bucket's start, repeated, plus the position within the bucket
+    within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return partition['incidents'][np.repeat(starts, lengths) + within]
+
+def query_incident_partition(partition, lat, lon, radius_km):
+    '''
+    Returns the incidents of one partition within radius_km of (lat, lon), looking only at the buckets that overlap
+    the bounding box of the circle.
+    '''
+    candidates = get_bucket_incidents(partition, get_candidate_buckets(partition, lat, lon, radius_km))
+    return candidates[points_within_radius(lat, lon, candidates['lat'], candidates['lon'], radius_km)]
+
+def count_incident_partition(partition, lat, lon, radius_km):
+    '''
+    Returns the number of incidents of one partition within radius_km of (lat, lon) in each month (array of 12).
+    Buckets that lie entirely inside the circle contribute their precomputed counts; only the incidents of the
+    buckets crossing the boundary are measured one by one.
+    '''
+    bucket_positions = get_candidate_buckets(partition, lat, lon, radius_km)
+    rows, columns = np.divmod(partition['bucket_ids'][bucket_positions].astype(np.int64), INCIDENT_BUCKET_COLUMNS)
+    corner_lats = np.stack([rows, rows, rows + 1, rows + 1], axis=1) * INCIDENT_BUCKET_DEGREES - 90
+    corner_lons = np.stack([columns, columns + 1, columns, columns + 1], axis=1) * INCIDENT_BUCKET_DEGREES - 180
+    # The farthest point of a bucket from the center is one of its corners
+    farthest = haversine_km(lat, lon, corner_lats, corner_lons).max(axis=1)
+    inside = farthest <= radius_km - GEODESIC_MARGIN_KM
+
+    counts = partition['bucket_counts'][bucket_positions[inside]].sum(axis=0, dtype=np.int64)
+    boundary = get_bucket_incidents(partition, bucket_positions[~inside])
+    boundary = boundary[points_within_radius(lat, lon, boundary['lat'], boundary['lon'], radius_km)]
+    counts += np.bincount(boundary['month'].astype(np.int64) - 1, minlength=12)
+    return counts
+
+def check_year_range(start_year, end_year):
+    # check if the input is valid
+    assert start_year >= 2015, "start_year must be later than 2015"
+    assert end_year <= 2023, "end_year must be earlier than 2023"
+    assert start_year <= end_year, "start_year must be earlier than end_year"
+
+def extract_historical_fire_data(lat, lon, start_year=2015, end_year=2023, source_file=INCIDENT_PRUNED_PATH):
     '''
     Finds all fire incidents within 36 km of the given latitude and longitude, and within the given time range.
     input:
@@ -33,58 +249,73 @@ def extract_historical_fire_data(lat, lon, start_year=2015, end_year=2023, sourc
         source_file: the source file of the historical data
     '''
 
-    # check if the input is valid
-    assert start_year >= 2015, "start_year must be later than 2015"
-    assert end_year <= 2023, "end_year must be earlier than 2023"
-    assert start_year <= end_year, "start_year must be earlier than end_year"
+    check_year_range(start_year, end_year)
 
-    # Load data
-    data = pd.read_csv(source_file)
-    
-    # Filter data by year
-    data = data[(data["year"] >= start_year) & (data["year"] <= end_year)]
+    # Load data, from the process-wide index unless another file is asked for
+    if source_file == INCIDENT_PRUNED_PATH:
+        partitions = incident_data.get()
+    else:
+        partitions = load_incident_partitions(source_file)
 
     max_distance_km = 36
 
-    # Calculate distances
-    distances = data.apply(lambda row: geodesic((lat, lon), (row['lat'], row['lon'])).kilometers, axis=1)
-    
-    # Filter data based on distance
-    data = data[distances <= max_distance_km]
+    # Only the partitions of the requested years are searched, each through its spatial buckets
+    incidents = [query_incident_partition(partitions[year], lat, lon, max_distance_km)
+                 for year in range(start_year, end_year + 1) if year in partitions]
+    if not incidents:
+        return pd.DataFrame(np.empty(0, dtype=INCIDENT_DTYPE))
+
+    data = pd.DataFrame(np.concatenate(incidents))
 
     return data
 
-import streamlit as st
+def count_historical_fire_data(lat, lon, start_year=2015, end_year=2023):
+    '''
+    Counts the fire incidents within 36 km of the given latitude and longitude, and within the given time range,
+    from the precomputed monthly counts per bucket.
+    Returns the incidents per year and the incidents per month (aggregated across years), leaving out zero counts
+    like value_counts does.
+    '''
+    check_year_range(start_year, end_year)
+    partitions = incident_data.get()
 
-def recent_fire_incident_data(lat, lon, start_year=2015, end_year=2023):
-    data = extract_historical_fire_data(lat, lon, start_year, end_year)
-    if type(data) == str:
-        return data  + " Please try again."
-    
-    # Count of incidents per year, sorted by year
-    incidents_per_year = data['year'].value_counts().sort_index()
+    max_distance_km = 36
 
-    # Count of incidents per month, sorted by month
-    incidents_per_month = data['month'].value_counts().sort_index()
-    # Assuming you have two DataFrames incidents_per_year and incidents_per_month
+    monthly_counts = {year: count_incident_partition(partitions[year], lat, lon, max_distance_km)
+                      for year in range(start_year, end_year + 1) if year in partitions}
 
-    # Create subplots with two rows and one column
-    fig = sp.make_subplots(rows=2, cols=1, shared_xaxes=False, subplot_titles=("Wildfire Incidents per Year", "Wildfire Incidents per Month, Aggregated Across Years"))
+    incidents_per_year = pd.Series({year: counts.sum() for year, counts in monthly_counts.items()}, dtype=np.int64, name='count')
+    incidents_per_year.index.name = 'year'
+    incidents_per_month = pd.Series(np.sum(list(monthly_counts.values()), axis=0, dtype=np.int64) if monthly_counts else np.zeros(12, dtype=np.int64),
+                                    index=pd.Index(range(1, 13), name='month'), name='count')
+    return incidents_per_year[incidents_per_year > 0], incidents_per_month[incidents_per_month > 0]
 
-    # Add the first line chart to the first subplot
-    fig.add_trace(go.Scatter(x=incidents_per_year.index, y=incidents_per_year, mode='lines', name='Yearly Incidents'), row=1, col=1)
+import streamlit as st
 
-    # Add the second line chart to the second subplot
-    fig.add_trace(go.Scatter(x=incidents_per_month.index, y=incidents_per_month, mode='lines', name='Monthly Incidents'), row=2, col=1)
+class IncidentMapDisplay(MapDisplay):
+    '''
+    Shows the fire incidents on a map. The incidents are only looked up, and the map built, when it is first
+    displayed; the built map is not pickled with the session state.
+    '''
+    def __init__(self, lat, lon, start_year, end_year):
+        super().__init__(None)
+        self.lat = lat
+        self.lon = lon
+        self.start_year = start_year
+        self.end_year = end_year
 
-    # Update subplot titles and labels
-    fig.update_layout(title_text=f"Wildfire Incidents within 36 km (22 miles) of the Location (lat: {lat}, lon: {lon}) ")
-    fig.update_xaxes(title_text="Year", row=1, col=1)
-    fig.update_xaxes(title_text="Month", row=2, col=1)
+    def display(self):
+        if self.map is None:
+            data = extract_historical_fire_data(self.lat, self.lon, self.start_year, self.end_year)
+            self.map = build_incident_map(data, self.lat, self.lon)
+        st.pydeck_chart(self.map)
 
-    # Summary of incidents
-    summary = f"The number of wildfire incidents within 36 km (22 miles) of the location (lat: {lat}, lon: {lon}) from {start_year} to {end_year} are as follows:\n\nIncidents per Year:\n{incidents_per_year}\n\nIncidents per Month:\n{incidents_per_month}\n"
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['map'] = None
+        return state
 
+def build_incident_map(data, lat, lon):
     view_state = pdk.ViewState(
         latitude=lat,
         longitude=lon,
@@ -110,11 +341,45 @@ def recent_fire_incident_data(lat, lon, start_year=2015, end_year=2023):
         tooltip={"text": "{year}-{month}"},
         map_style = 'mapbox://styles/mapbox/light-v10'
     )
+    return maps
+
+def recent_fire_incident_data(lat, lon, start_year=2015, end_year=2023):
+    # Count of incidents per year and per month, sorted by year and month
+    incidents_per_year, incidents_per_month = count_historical_fire_data(lat, lon, start_year, end_year)
+    # Assuming you have two DataFrames incidents_per_year and incidents_per_month
+
+    # Create subplots with two rows and one column
+    fig = sp.make_subplots(rows=2, cols=1, shared_xaxes=False, subplot_titles=("Wildfire Incidents per Year", "Wildfire Incidents per Month, Aggregated Across Years"))
+
+    # Add the first line chart to the first subplot
+    fig.add_trace(go.Scatter(x=incidents_per_year.index, y=incidents_per_year, mode='lines', name='Yearly Incidents'), row=1, col=1)
 
-    maps = [f"The Fire Incident Records (shown in red dots) within 36 km (22 miles) of the location (lat: {lat}, lon: {lon})" , MapDisplay(maps)]
+    # Add the second line chart to the second subplot
+    fig.add_trace(go.Scatter(x=incidents_per_month.index, y=incidents_per_month, mode='lines', name='Monthly Incidents'), row=2, col=1)
+
+    # Update subplot titles and labels
+    fig.update_layout(title_text=f"Wildfire Incidents within 36 km (22 miles) of the Location (lat: {lat}, lon: {lon}) ")
+    fig.update_xaxes(title_text="Year", row=1, col=1)
+    fig.update_xaxes(title_text="Month", row=2, col=1)
+
+    # Summary of incidents
+    summary = f"The number of wildfire incidents within 36 km (22 miles) of the location (lat: {lat}, lon: {lon}) from {start_year} to {end_year} are as follows:\n\nIncidents per Year:\n{incidents_per_year}\n\nIncidents per Month:\n{incidents_per_month}\n"
+
+    # The incidents themselves are only looked up when the map is displayed
+    maps = IncidentMapDisplay(lat, lon, start_year, end_year)
+
+    maps = [f"The Fire Incident Records (shown in red dots) within 36 km (22 miles) of the location (lat: {lat}, lon: {lon})" , maps]
 
     return summary, maps, [fig]
     
 if __name__ == "__main__":
-    #prune_data()
-    summary, maps, [fig] = recent_fire_incident_data(33.9534, -117.3962, 2016, 2022)
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--prune', action='store_true', help='Build the pruned CSV and the per-year partitions from the raw incident file')
+    args = parser.parse_args()
+
+    if args.prune:
+        partitions = prune_data()
+        print(f"Wrote {sum(len(partition['incidents']) for partition in partitions.values())} wildfire incidents in {len(partitions)} yearly partitions to {INCIDENT_PARTITION_DIR}")
+    else:
+        summary, maps, [fig] = recent_fire_incident_data(33.9534, -117.3962, 2016, 2022)
\ No newline at end of file
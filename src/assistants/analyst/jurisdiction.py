@@ -0,0 +1,102 @@
+import os
+import geopandas as gpd
+import numpy as np
+import shapely
+from src.assistants.analyst.utils import SharedResource, write_atomically
+
+# Local copies of the TIGER state and county boundaries, used to find the jurisdiction of a coordinate offline
+JURISDICTION_DIR = './data/census'
+TIGER_BOUNDARY_URLS = {
+    'state': "https://www2.census.gov/geo/tiger/TIGER2022/STATE/tl_2022_us_state.zip",
+    'county': "https://www2.census.gov/geo/tiger/TIGER2022/COUNTY/tl_2022_us_county.zip"
+}
+BOUNDARY_COLUMNS = {
+    'state': ['GEOID', 'STUSPS', 'NAME'],
+    'county': ['GEOID', 'STATEFP', 'COUNTYFP', 'NAME']
+}
+
+
+def get_boundary_path(level):
+    return os.path.join(JURISDICTION_DIR, f"tl_2022_us_{level}.gpkg")
+
+def build_boundary_store(level):
+    '''
+    Downloads the 2022 TIGER boundaries of a level ('state' or 'county'), reprojects them to EPSG:4326 and saves
+    them as a GeoPackage.
+    '''
+    level_boundaries = gpd.read_file(TIGER_BOUNDARY_URLS[level]).to_crs(epsg=4326)
+    level_boundaries = level_boundaries[BOUNDARY_COLUMNS[level] + ['geometry']]
+
+    os.makedirs(JURISDICTION_DIR, exist_ok=True)
+    path = get_boundary_path(level)
+    write_atomically(path, lambda tmp: level_boundaries.to_file(tmp.name, driver="GPKG", layer=level), suffix=".gpkg")
+    return path
+
+def load_boundaries(level):
+    '''
+    Loads the boundaries of a level from the local store, building the store on first use.
+    Returns a dict with the prepared 'geometries', their spatial index ('tree') and the attributes of every
+    boundary ('records'), so a lookup never goes through pandas.
+    '''
+    path = get_boundary_path(level)
+    if not os.path.exists(path):
+        build_boundary_store(level)
+    level_boundaries = gpd.read_file(path, layer=level)
+
+    geometries = level_boundaries.geometry.to_numpy()
+    shapely.prepare(geometries)
+    return {
+        'geometries': geometries,
+        'tree': shapely.STRtree(geometries),
+        'records': level_boundaries[BOUNDARY_COLUMNS[level]].to_dict('records')
+    }
+
+# Process-wide boundaries, one per level, shared by all sessions and tools
+boundaries = {level: SharedResource(lambda level=level: load_boundaries(level)) for level in TIGER_BOUNDARY_URLS}
+
+def get_jurisdiction(lat, lon, level='state'):
+    '''
+    Finds the state or county containing a coordinate.
+
+    Parameters:
+    - lat: Latitude of the location.
+    - lon: Longitude of the location.
+    - level: 'state' or 'county'.
+
+    Returns:
+    - A dict with the attributes of the jurisdiction (see BOUNDARY_COLUMNS; GEOID is the FIPS code), or None if
+      the location is outside the US.
+    '''
+    level_boundaries = boundaries[level].get()
+    # Bounding box candidates from the index, then an exact test against the prepared polygons
+    candidates = np.sort(level_boundaries['tree'].query(shapely.points(lon, lat)))
+    inside = shapely.intersects_xy(level_boundaries['geometries'][candidates], lon, lat)
+    if not inside.any():
+        return None
+    return dict(level_boundaries['records'][candidates[inside][0]])
+
+def get_jurisdictions_within(geometry, level='state'):
+    '''
+    Returns the attributes (see BOUNDARY_COLUMNS) of every state or county intersecting a geometry in EPSG:4326,
+    e.g. all the states a buffer around a location reaches into.
+    '''
+    level_boundaries = boundaries[level].get()
+    positions = np.sort(level_boundaries['tree'].query(geometry, predicate='intersects'))
+    return [dict(level_boundaries['records'][position]) for position in positions]
+
+def get_state_fips(lat, lon):
+    '''
+    Returns the two-digit FIPS code of the state containing a coordinate, or None if it is outside the US.
+    '''
+    state = get_jurisdiction(lat, lon, level='state')
+    return None if state is None else state['GEOID']
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the local state and county boundary files used to resolve jurisdictions.")
+    parser.add_argument("--levels", nargs="*", default=list(TIGER_BOUNDARY_URLS), choices=list(TIGER_BOUNDARY_URLS))
+    args = parser.parse_args()
+
+    for level in args.levels:
+        print(f"📦 {level} boundaries -> {build_boundary_store(level)}")
@@ -1,44 +1,124 @@
 import pandas as pd
 import requests
-import gzip
 import shutil
-import tempfile
 import os
 import glob
-from sentence_transformers import SentenceTransformer
-import faiss
-import pickle
+import json
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
 import numpy as np
+from src.assistants.analyst.utils import SharedResource, write_atomically
 
-# --- HELPER: Reassemble split files ---
-def get_assembled_file_path(original_filename):
+# --- INDEX ARTIFACT ---
+# The FAISS index ships gzipped, possibly split into .partXXX chunks. It is decompressed once into a versioned
+# cache directory with a manifest, and later starts memory-map the uncompressed file, so worker processes share
+# its pages instead of each holding a private copy.
+
+LITERATURE_DATA_DIR = "./data"
+LITERATURE_CACHE_DIR = os.getenv("LITERATURE_CACHE_DIR", "./data/cache")
+
+def get_source_files(original_filename, data_dir=LITERATURE_DATA_DIR):
     """
-    Checks if the file exists. If not, tries to reassemble it from .partXXX chunks.
-    Returns the path to the usable file.
+    Returns the file itself if it exists, otherwise its .partXXX chunks in order.
     """
-    base_path = f"./data/{original_filename}"
+    base_path = os.path.join(data_dir, original_filename)
     
     # If the file is already there (local machine), just use it
     if os.path.exists(base_path):
-        return base_path
+        return [base_path]
 
     # If not, look for parts (e.g., file.gz.part000)
-    # We stitch them into a temp file
-    part_pattern = f"{base_path}.part*"
-    parts = sorted(glob.glob(part_pattern))
-    
+    parts = sorted(glob.glob(f"{base_path}.part*"))
     if not parts:
-        raise FileNotFoundError(f"Could not find {original_filename} or its parts in ./data/")
-
-    # Create a temp file to hold the stitched data
-    # We use delete=False so we can read it later
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".gz") as tmp_assembled:
-        for part in parts:
-            with open(part, "rb") as p:
-                shutil.copyfileobj(p, tmp_assembled)
-        assembled_path = tmp_assembled.name
-    
-    return assembled_path
+        raise FileNotFoundError(f"Could not find {original_filename} or its parts in {data_dir}")
+    return parts
+
+def get_source_fingerprint(source_files):
+    # Names, sizes and modification times of the sources identify a version without reading them
+    fingerprint = hashlib.sha256()
+    for path in source_files:
+        stat = os.stat(path)
+        fingerprint.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+    return fingerprint.hexdigest()[:16]
+
+def get_file_checksum(path):
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+def materialize_index(original_filename="wildfire_index.bin.gz", data_dir=LITERATURE_DATA_DIR, cache_dir=LITERATURE_CACHE_DIR):
+    """
+    Returns the path of the uncompressed index in cache_dir/<name>/<fingerprint>/, decompressing the sources
+    only if that version has not been materialized yet. The manifest (sources, size and sha256 of the index) is
+    written last, so an interrupted run is simply redone. Older versions are removed.
+    """
+    source_files = get_source_files(original_filename, data_dir)
+    if not original_filename.endswith(".gz") and len(source_files) == 1:
+        # An uncompressed index, e.g. an ANN index built locally, can be mapped where it is
+        return source_files[0]
+    name = original_filename[:-len(".gz")] if original_filename.endswith(".gz") else original_filename
+    artifact_root = os.path.join(cache_dir, os.path.splitext(name)[0])
+    artifact_dir = os.path.join(artifact_root, get_source_fingerprint(source_files))
+    index_path = os.path.join(artifact_dir, name)
+    manifest_path = os.path.join(artifact_dir, "manifest.json")
+
+    if os.path.exists(manifest_path) and os.path.exists(index_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest["size"] == os.path.getsize(index_path):
+            return index_path
+
+    os.makedirs(artifact_dir, exist_ok=True)
+    checksum = hashlib.sha256()
+    size = 0
+    # Stream the chunks through the decompressor one after the other, so no stitched copy is ever written
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if original_filename.endswith(".gz") else None
+
+    def write_index(tmp_index):
+        nonlocal size
+        for path in source_files:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    data = decompressor.decompress(chunk) if decompressor else chunk
+                    checksum.update(data)
+                    tmp_index.write(data)
+                    size += len(data)
+        if decompressor:
+            data = decompressor.flush()
+            checksum.update(data)
+            tmp_index.write(data)
+            size += len(data)
+            # Unlike gzip.open, the decompressor does not complain when the stream just stops, e.g. a missing chunk
+            if not decompressor.eof:
+                raise EOFError(f"{original_filename} ended before the end of the compressed index; are all its parts in {data_dir}?")
+            if decompressor.unused_data:
+                raise ValueError(f"{original_filename} has unexpected data after the end of the compressed index")
+
+    write_atomically(index_path, write_index)
+
+    manifest = {
+        "sources": [{"name": os.path.basename(path), "size": os.path.getsize(path)} for path in source_files],
+        "size": size,
+        "sha256": checksum.hexdigest()
+    }
+    write_atomically(manifest_path, lambda f: f.write(json.dumps(manifest, indent=2).encode("utf-8")))
+
+    for old_version in os.listdir(artifact_root):
+        if old_version != os.path.basename(artifact_dir):
+            shutil.rmtree(os.path.join(artifact_root, old_version), ignore_errors=True)
+    return index_path
+
+def verify_index(index_path):
+    """
+    Checks the materialized index against the sha256 in its manifest.
+    """
+    with open(os.path.join(os.path.dirname(index_path), "manifest.json"), "r") as f:
+        manifest = json.load(f)
+    return get_file_checksum(index_path) == manifest["sha256"]
 
 # --- CORE FUNCTIONS ---
 
@@ -54,44 +134,156 @@ def get_doi_by_title(title):
         pass
     return "Failed to fetch data"
 
-# 1. Load CSV (Uses the helper logic automatically if needed)
-# Note: For the CSV, we assume it's small enough or handled similarly. 
-# If you split the CSV too, use the helper. If not, leave as is.
-csv_path = "./data/wildfire_literature.csv.gz"
-if not os.path.exists(csv_path):
-    # Fallback if you decided to split the CSV too (optional)
-    pass 
-df = pd.read_csv(csv_path)
-df['combined_text'] = df['title'] + ' ' + df['abstract'] + ' ' + df['field']
+# --- LAZY LOADING ---
+# The papers, the FAISS index and the embedding model are loaded once per process, on the first search (or by
+# warm_up_literature in the background), instead of when the app imports this module
 
+LITERATURE_CSV_PATH = "./data/wildfire_literature.csv.gz"
+LITERATURE_MODEL_NAME = 'all-MiniLM-L6-v2'
+# Index searched by literature_search: 'flat' (exact) or an ANN index built with
+# `python src/literature/index.py build --index_type ...` ('ivf_flat', 'ivf_pq' or 'hnsw'); see its `tune` command
+# for the recall and latency of each type and setting. FAISS cannot memory-map the IVF indexes, so each process
+# reads those into its own memory
+LITERATURE_INDEX_TYPE = os.getenv("LITERATURE_INDEX_TYPE", "flat")
+# 'l2' or 'cosine'; a cosine index (built with --metric cosine) needs normalized queries, which search() handles
+LITERATURE_INDEX_METRIC = os.getenv("LITERATURE_INDEX_METRIC", "l2")
+LITERATURE_NPROBE = int(os.getenv("LITERATURE_NPROBE", 16))
+LITERATURE_EF_SEARCH = int(os.getenv("LITERATURE_EF_SEARCH", 64))
+# Set LITERATURE_WARM_UP=0 to skip the background warm-up and load on the first literature_search instead
+LITERATURE_WARM_UP = os.getenv("LITERATURE_WARM_UP", "1").lower() not in ("0", "false", "no")
 
-# 2. Load FAISS Index (Stitch -> Unzip -> Load)
-index_gz_path = get_assembled_file_path("wildfire_index.bin.gz")
+def load_index():
+    import faiss
+    from src.literature.index import get_index_filename, set_search_parameters
 
-# Unzip the (potentially stitched) GZ to a raw binary temp file for FAISS
-with tempfile.NamedTemporaryFile(delete=False) as tmp_index:
-    with gzip.open(index_gz_path, 'rb') as f_in:
-        shutil.copyfileobj(f_in, tmp_index)
-    temp_index_name = tmp_index.name
+    # The flat index ships gzipped; ANN indexes built with src/literature/index.py are plain files
+    original_filename = get_index_filename(LITERATURE_INDEX_TYPE, LITERATURE_INDEX_METRIC)
+    if glob.glob(os.path.join(LITERATURE_DATA_DIR, original_filename + ".gz*")):
+        original_filename += ".gz"
+    index_path = materialize_index(original_filename)
+    try:
+        # Memory-map the index; IO_FLAG_MMAP_IFC (newer FAISS) extends this to flat indexes
+        index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0))
+    except RuntimeError as e:
+        # Index types that cannot be memory-mapped are read into memory
+        print(f"Cannot memory-map the {LITERATURE_INDEX_TYPE} literature index ({e}); reading it into memory instead.")
+        index = faiss.read_index(index_path)
+    return set_search_parameters(index, nprobe=LITERATURE_NPROBE, ef_search=LITERATURE_EF_SEARCH)
 
-index = faiss.read_index(temp_index_name)
-os.remove(temp_index_name) # Cleanup raw binary
+def load_literature():
+    """
+    Loads the papers, the FAISS index and the sentence embedding model used by search().
+    The document embeddings are not loaded: the index already holds them.
+    """
+    # Imported here because importing torch alone takes seconds
+    from sentence_transformers import SentenceTransformer
+
+    df = pd.read_csv(LITERATURE_CSV_PATH)
+    df['combined_text'] = df['title'] + ' ' + df['abstract'] + ' ' + df['field']
+    index = load_index()
+    model = SentenceTransformer(LITERATURE_MODEL_NAME, device='cpu')
+    return {"papers": df, "index": index, "model": model}
+
+# Process-wide literature search stack, shared by all sessions
+literature = SharedResource(load_literature)
+warm_up_thread = None
+warm_up_lock = threading.Lock()
+
+def warm_up_literature():
+    """
+    Starts loading the literature search stack in a background thread, so the first literature_search does not
+    wait for it. Does nothing if warm-up is disabled, or if loading already started. Returns the thread, if any.
+    """
+    global warm_up_thread
+
+    def warm_up():
+        try:
+            literature.get()
+        except Exception as e:
+            # The first literature_search will try again and report the error
+            print(f"Literature search warm-up failed: {e}")
+
+    with warm_up_lock:
+        if LITERATURE_WARM_UP and warm_up_thread is None and not literature.loaded:
+            warm_up_thread = threading.Thread(target=warm_up, name="literature-warm-up", daemon=True)
+            warm_up_thread.start()
+        return warm_up_thread
 
+# --- QUERY EMBEDDINGS ---
+# Query embeddings are cached in memory (LRU) and on disk, keyed by the model and the normalized query text.
+# all-MiniLM-L6-v2 is uncased and ignores extra whitespace, so normalized queries embed exactly like the originals.
 
-# 3. Load Embeddings (Stitch -> Load)
-# We don't use this variable in the search function below, but loading it to match your original code
-emb_gz_path = get_assembled_file_path("document_embeddings.pkl.gz")
-with gzip.open(emb_gz_path, "rb") as f:
-    embeddings = pickle.load(f)
+LITERATURE_QUERY_CACHE_DIR = os.getenv("LITERATURE_QUERY_CACHE_DIR", "./data/cache/query_embeddings")
+LITERATURE_QUERY_CACHE_SIZE = 4096
+query_embeddings = OrderedDict()
+query_embeddings_lock = threading.Lock()
 
+def normalize_query(query):
+    return " ".join(str(query).lower().split())
 
-# Load Model
-model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
+def get_query_cache_path(key):
+    digest = hashlib.sha256(f"{LITERATURE_MODEL_NAME}\n{key}".encode("utf-8")).hexdigest()
+    return os.path.join(LITERATURE_QUERY_CACHE_DIR, f"{digest}.npy")
+
+def remember_query_embedding(key, vector):
+    with query_embeddings_lock:
+        query_embeddings[key] = vector
+        query_embeddings.move_to_end(key)
+        while len(query_embeddings) > LITERATURE_QUERY_CACHE_SIZE:
+            query_embeddings.popitem(last=False)
+
+def encode_queries(queries):
+    """
+    Returns the embeddings of the queries (one float32 row each), taken from the memory or disk cache when
+    possible; the remaining distinct queries are encoded together in one batch and cached.
+    """
+    keys = [normalize_query(query) for query in queries]
+    vectors = {}
+    missing = []
+    for key in dict.fromkeys(keys):
+        with query_embeddings_lock:
+            vector = query_embeddings.get(key)
+        if vector is None:
+            cache_path = get_query_cache_path(key)
+            if os.path.exists(cache_path):
+                try:
+                    vector = np.load(cache_path)
+                except (OSError, ValueError):
+                    vector = None
+        if vector is None:
+            missing.append(key)
+        else:
+            vectors[key] = vector
+            remember_query_embedding(key, vector)
+
+    if missing:
+        encoded = literature.get()["model"].encode(missing).astype(np.float32)
+        os.makedirs(LITERATURE_QUERY_CACHE_DIR, exist_ok=True)
+        for key, vector in zip(missing, encoded):
+            vectors[key] = vector
+            remember_query_embedding(key, vector)
+            write_atomically(get_query_cache_path(key), lambda tmp: np.save(tmp, vector))
+
+    return np.stack([vectors[key] for key in keys])
+
+def search_many(queries, k=3):
+    """
+    Searches the literature for several queries at once: the queries are encoded in one batch and the index is
+    searched once. Returns one DataFrame of the k closest papers per query, in order; ANN indexes may find fewer
+    than k papers for a query.
+    """
+    if len(queries) == 0:
+        return []
+    stack = literature.get()
+    query_vectors = encode_queries(queries)
+    if LITERATURE_INDEX_METRIC == "cosine":
+        query_vectors = query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    _, indices = stack["index"].search(query_vectors, k)
+    # IVF and HNSW pad the results with -1 when they find fewer than k neighbours
+    return [stack["papers"].iloc[row[row >= 0]].reset_index(drop=True) for row in indices]
 
 def search(query, k=3):
-    query_vector = model.encode([query]).astype(np.float32)
-    _, indices = index.search(query_vector, k)
-    return df.iloc[indices[0]].reset_index(drop=True)
+    return search_many([query], k)[0]
     
 def get_author(authors_str):
     import ast
@@ -125,5 +317,14 @@ def literature_search(query):
     return message
 
 if __name__ == "__main__":
-    query = "wildfire mitigation strategies"
-    print(literature_search(query))
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Search the wildfire literature, or prepare its index.")
+    parser.add_argument("query", nargs="?", default="wildfire mitigation strategies")
+    parser.add_argument("--materialize", action="store_true", help="Only decompress the index into the cache and verify it")
+    args = parser.parse_args()
+
+    if args.materialize:
+        index_path = materialize_index("wildfire_index.bin.gz")
+        print(f"{'✅' if verify_index(index_path) else '❌ Checksum mismatch:'} {index_path}")
+    else:
+        print(literature_search(args.query))
\ No newline at end of file
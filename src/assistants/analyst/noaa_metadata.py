@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from src.assistants.analyst.utils import write_atomically
+
+# Local mirror of the NOAA fire history metadata files, keyed by URL
+NOAA_METADATA_CACHE_DIR = os.getenv("NOAA_METADATA_CACHE_DIR", "./data/noaa_metadata_cache")
+# Cached files younger than this are used without asking NOAA; older ones are revalidated with their ETag
+NOAA_METADATA_TTL = float(os.getenv("NOAA_METADATA_TTL", 30 * 24 * 3600))
+# URLs whose download failed are not requested again by the tools for this long (per process)
+NOAA_METADATA_FAILURE_TTL = float(os.getenv("NOAA_METADATA_FAILURE_TTL", 3600))
+# Set NOAA_METADATA_OFFLINE=1 to never call NOAA from the tools: only the mirror is used, however old
+NOAA_METADATA_OFFLINE = os.getenv("NOAA_METADATA_OFFLINE", "0").lower() in ("1", "true", "yes")
+NOAA_METADATA_TIMEOUT = 10
+# Maximum number of metadata files fetched at the same time (and of pooled connections)
+NOAA_METADATA_WORKERS = 8
+
+# Parsed metadata, keyed by (parser name, content checksum), so the same file is never parsed twice per process
+parsed_metadata = {}
+# Time of the last failed download of each URL
+failed_downloads = {}
+url_locks = {}
+url_locks_lock = threading.Lock()
+session = None
+session_lock = threading.Lock()
+
+
+def get_cache_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+def get_cache_paths(url, cache_dir=NOAA_METADATA_CACHE_DIR):
+    '''
+    Returns the paths of the cached content and of its metadata (URL, ETag, fetch time, checksum) for a URL.
+    '''
+    key = get_cache_key(url)
+    return os.path.join(cache_dir, f"{key}.txt"), os.path.join(cache_dir, f"{key}.json")
+
+def get_session():
+    '''
+    Returns the process-wide requests.Session, whose pooled connections are reused by all the metadata downloads.
+    '''
+    global session
+    with session_lock:
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=NOAA_METADATA_WORKERS, pool_maxsize=NOAA_METADATA_WORKERS)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        return session
+
+def get_url_lock(url):
+    with url_locks_lock:
+        return url_locks.setdefault(url, threading.Lock())
+
+def read_cache_entry(url, cache_dir=NOAA_METADATA_CACHE_DIR):
+    content_path, entry_path = get_cache_paths(url, cache_dir)
+    if not (os.path.exists(content_path) and os.path.exists(entry_path)):
+        return None
+    with open(entry_path, "r") as f:
+        entry = json.load(f)
+    entry["path"] = content_path
+    return entry
+
+def download_metadata(url, entry=None, cache_dir=NOAA_METADATA_CACHE_DIR, session=None, timeout=NOAA_METADATA_TIMEOUT):
+    '''
+    Downloads a metadata file into the cache, sending the cached ETag/Last-Modified so an unchanged file is not
+    downloaded again. Returns the new cache entry, or the old one if the download fails; failures are recorded in
+    failed_downloads.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    content_path, entry_path = get_cache_paths(url, cache_dir)
+    headers = {}
+    if entry is not None:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    try:
+        # Closing the streamed response returns its connection to the session's pool
+        with (session or get_session()).get(url, headers=headers, timeout=timeout, stream=True) as response:
+            if response.status_code == 304 and entry is not None:
+                entry["fetched_at"] = time.time()
+            elif response.status_code == 200:
+                checksum = hashlib.sha256()
+                def write_content(f):
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        checksum.update(chunk)
+                        f.write(chunk)
+                write_atomically(content_path, write_content)
+                entry = {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "encoding": response.encoding or "utf-8",
+                    "sha256": checksum.hexdigest(),
+                    "fetched_at": time.time()
+                }
+            else:
+                print(f"Failed to download {url}. Status code: {response.status_code}")
+                failed_downloads[url] = time.time()
+                return entry
+    except Exception as e:
+        print(f"An error occurred while downloading {url}: {e}")
+        failed_downloads[url] = time.time()
+        return entry
+
+    failed_downloads.pop(url, None)
+    entry = {key: value for key, value in entry.items() if key != "path"}
+    write_atomically(entry_path, lambda f: f.write(json.dumps(entry).encode("utf-8")))
+    entry["path"] = content_path
+    return entry
+
+def fetch_metadata(url, cache_dir=NOAA_METADATA_CACHE_DIR, ttl=NOAA_METADATA_TTL, offline=NOAA_METADATA_OFFLINE, session=None,
+                   failure_ttl=NOAA_METADATA_FAILURE_TTL):
+    '''
+    Returns the cache entry of a metadata file (its local 'path', 'encoding' and content 'sha256', among others),
+    downloading it only if it is not cached or older than ttl, and its last download did not fail within
+    failure_ttl. In offline mode the network is never used.
+    Returns None if the file is neither cached nor downloadable.
+    '''
+    with get_url_lock(url):
+        entry = read_cache_entry(url, cache_dir)
+        if offline or (entry is not None and time.time() - entry["fetched_at"] < ttl):
+            return entry
+        if time.time() - failed_downloads.get(url, float("-inf")) < failure_ttl:
+            return entry
+        return download_metadata(url, entry, cache_dir, session=session)
+
+def get_parsed_metadata(url, parser, **fetch_kwargs):
+    '''
+    Returns parser(path, encoding) for the cached metadata file of url, or None if the file is unavailable.
+    Parsed results must be JSON-serializable; they are kept in memory and next to the cached file, keyed by the
+    content checksum, so a file is parsed again only when its content changes.
+    '''
+    entry = fetch_metadata(url, **fetch_kwargs)
+    if entry is None:
+        return None
+
+    key = (parser.__name__, entry["sha256"])
+    if key in parsed_metadata:
+        return parsed_metadata[key]
+
+    parsed_path = f"{os.path.splitext(entry['path'])[0]}.{parser.__name__}.json"
+    parsed = None
+    if os.path.exists(parsed_path):
+        with open(parsed_path, "r") as f:
+            cached = json.load(f)
+        if cached["sha256"] == entry["sha256"]:
+            parsed = cached["parsed"]
+    if parsed is None:
+        parsed = parser(entry["path"], entry["encoding"])
+        write_atomically(parsed_path, lambda f: f.write(json.dumps({"sha256": entry["sha256"], "parsed": parsed}).encode("utf-8")))
+
+    parsed_metadata[key] = parsed
+    return parsed
+
+def map_concurrently(function, urls, workers=NOAA_METADATA_WORKERS):
+    '''
+    Calls function(url) for every URL on a bounded thread pool and returns the results in the order of urls.
+    '''
+    urls = list(urls)
+    if len(urls) <= 1:
+        return [function(url) for url in urls]
+    with ThreadPoolExecutor(max_workers=min(workers, len(urls))) as executor:
+        return list(executor.map(function, urls))
+
+def prefetch_metadata(urls, cache_dir=NOAA_METADATA_CACHE_DIR, refresh=False, workers=NOAA_METADATA_WORKERS):
+    '''
+    Mirrors the given metadata files into the cache. Files already cached are only revalidated if refresh is set.
+    Returns the URLs that could not be fetched.
+    '''
+    def prefetch(url):
+        with get_url_lock(url):
+            entry = read_cache_entry(url, cache_dir)
+            if entry is None or refresh:
+                entry = download_metadata(url, entry, cache_dir)
+        return entry
+
+    entries = map_concurrently(prefetch, urls, workers)
+    return [url for url, entry in zip(urls, entries) if entry is None]
+
+
+if __name__ == "__main__":
+    import argparse
+    import pandas as pd
+    parser = argparse.ArgumentParser(description="Mirror the NOAA fire history metadata files so the tools can answer offline.")
+    parser.add_argument("--source_file", default="./data/s1-NAFSS.csv")
+    parser.add_argument("--cache_dir", default=NOAA_METADATA_CACHE_DIR)
+    parser.add_argument("--refresh", action="store_true", help="Revalidate files that are already cached")
+    parser.add_argument("--workers", type=int, default=NOAA_METADATA_WORKERS)
+    args = parser.parse_args()
+
+    urls = pd.read_csv(args.source_file)["link_to_metadata"].dropna().unique()
+    print(f"⏳ Mirroring {len(urls)} metadata files to {args.cache_dir}...")
+    failed = prefetch_metadata(urls, args.cache_dir, refresh=args.refresh, workers=args.workers)
+    print(f"✅ Mirrored {len(urls) - len(failed)} files.")
+    for url in failed:
+        print(f"⚠️ Could not fetch {url}")
@@ -1,29 +1,124 @@
 import geopandas as gpd
 import pydeck as pdk
-from shapely.geometry import Point, mapping
-from shapely.ops import transform
 from geopandas import GeoDataFrame
 import pandas as pd
-from functools import partial
+import numpy as np
 import pyproj
+import os
+import tempfile
+import threading
+from src.assistants.analyst.geometry import geodesic_buffer
 import streamlit as st
 
+class SharedResource:
+    '''
+    Holds data that is loaded once per process and shared by every Streamlit session.
+    The loader runs lazily on the first get(); reload() re-runs it, e.g. after the files on disk change.
+    '''
+    def __init__(self, loader):
+        self._loader = loader
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                # Another session may have finished loading while we waited for the lock
+                if not self._loaded:
+                    self._value = self._loader()
+                    self._loaded = True
+        return self._value
+
+    def reload(self):
+        # Load the new copy before swapping it in, so concurrent readers keep using the old one
+        value = self._loader()
+        with self._lock:
+            self._value = value
+            self._loaded = True
+        return value
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+def write_atomically(path, write, suffix=""):
+    '''
+    Writes a file through a temporary file next to it that replaces path only once complete, so readers never
+    see a partial file. write receives the open temporary file (binary); writers that need a path, such as
+    GeoDataFrame.to_file, can use its .name. The temporary file is removed if write fails.
+    '''
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or ".", suffix=suffix, delete=False) as tmp:
+        try:
+            write(tmp)
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    os.replace(tmp.name, path)
+
+# Mean Earth radius used for the haversine distances
+EARTH_RADIUS_KM = 6371.0088
+# Haversine differs from the WGS84 geodesic distance by at most ~0.5%; points whose haversine distance is
+# this close to the radius are re-measured exactly
+GEODESIC_MARGIN_KM = 0.5
+wgs84_geod = pyproj.Geod(ellps='WGS84')
+
+def haversine_km(lat, lon, lats, lons):
+    '''
+    Great-circle distances in kilometers from (lat, lon) to every point in the arrays lats, lons.
+    '''
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(np.asarray(lats, dtype=np.float64)), np.radians(np.asarray(lons, dtype=np.float64))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def bounding_box(lat, lon, radius_km):
+    '''
+    Returns (min_lat, max_lat, delta_lon) of a lat/lon box guaranteed to contain the circle of radius_km around (lat, lon).
+    delta_lon is None when the box reaches a pole, i.e. every longitude has to be considered.
+    '''
+    # One degree of latitude is at least 110.5 km on the WGS84 ellipsoid
+    delta_lat = radius_km / 110.5
+    max_abs_lat = min(abs(lat) + delta_lat, 90)
+    delta_lon = delta_lat / np.cos(np.radians(max_abs_lat)) if max_abs_lat < 89 else None
+    return lat - delta_lat, lat + delta_lat, delta_lon
+
+def bounding_box_mask(lat, lon, lats, lons, radius_km):
+    '''
+    Cheap prefilter: marks the points inside a lat/lon box that is guaranteed to contain the circle of radius_km.
+    '''
+    lats = np.asarray(lats)
+    lons = np.asarray(lons)
+    min_lat, max_lat, delta_lon = bounding_box(lat, lon, radius_km)
+    mask = (lats >= min_lat) & (lats <= max_lat)
+    if delta_lon is not None:
+        # Wrap the longitude difference so the box also works across the antimeridian
+        mask &= np.abs((lons - lon + 180) % 360 - 180) <= delta_lon
+    return mask
+
+def points_within_radius(lat, lon, lats, lons, radius_km):
+    '''
+    Returns a boolean mask of the points in lats, lons whose geodesic (WGS84) distance to (lat, lon) is at most radius_km.
+    Points are prefiltered with a bounding box, measured with vectorized haversine, and only those near the
+    boundary of the circle are measured exactly with the geodesic.
+    '''
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    mask = np.zeros(len(lats), dtype=bool)
+
+    candidates = np.flatnonzero(bounding_box_mask(lat, lon, lats, lons, radius_km + GEODESIC_MARGIN_KM))
+    distances = haversine_km(lat, lon, lats[candidates], lons[candidates])
+    mask[candidates[distances <= radius_km - GEODESIC_MARGIN_KM]] = True
+
+    boundary = candidates[np.abs(distances - radius_km) < GEODESIC_MARGIN_KM]
+    if len(boundary) > 0:
+        _, _, geodesic_m = wgs84_geod.inv(np.full(len(boundary), lon), np.full(len(boundary), lat), lons[boundary], lats[boundary])
+        mask[boundary[geodesic_m / 1000 <= radius_km]] = True
+    return mask
+
 def create_geographic_circle(lat, lon, radius_in_km):
-    local_azimuthal_projection = f"+proj=aeqd +R=6371000 +units=m +lat_0={lat} +lon_0={lon}"
-    wgs84_to_aeqd = partial(
-        pyproj.transform,
-        pyproj.Proj('+proj=longlat +datum=WGS84 +no_defs'),
-        pyproj.Proj(local_azimuthal_projection),
-    )
-    aeqd_to_wgs84 = partial(
-        pyproj.transform,
-        pyproj.Proj(local_azimuthal_projection),
-        pyproj.Proj('+proj=longlat +datum=WGS84 +no_defs'),
-    )
-    point_transformed = transform(wgs84_to_aeqd, Point(lon, lat))
-    circle = point_transformed.buffer(radius_in_km * 1000)  # radius in meters
-    circle_wgs84 = transform(aeqd_to_wgs84, circle)
-    return circle_wgs84
+    return geodesic_buffer(lat, lon, radius_in_km)
 
 def get_pinned_map(lat, lon, radius_in_km=36):
 
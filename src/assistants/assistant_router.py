@@ -1,6 +1,7 @@
 from src.assistants.profile import ChecklistAssistant
 from src.assistants.plan import PlanAssistant
 from src.assistants.analyst import AnalystAssistant
+from src.assistants.analyst.literature import warm_up_literature
 import uuid
 
 # --- MOCK THREAD CLASS ---
@@ -44,6 +45,9 @@ class AssistantRouter:
         config_path = self.assistant_dict[name][1]
         self.current_assistant = Assistant(config_path, self.update_assistant, **args)
 
+        # Load the literature search model and index in the background while the client talks to the first assistants
+        warm_up_literature()
+
     def update_assistant(self, name, args, new_thread = False):
         Assistant = self.assistant_dict[name][0]
         config_path = self.assistant_dict[name][1]
@@ -0,0 +1,49 @@
+import argparse
+import numpy as np
+import pandas as pd
+from sentence_transformers import SentenceTransformer
+from src.literature.index import METRICS, EMBEDDINGS_PATH, load_embeddings, build_index, normalize_embeddings
+
+# Compares the ranking quality of the L2 and cosine literature indexes. Without labelled queries, every sampled
+# paper's title is used as a query whose relevant result is the paper itself (title -> paper self-retrieval).
+
+
+def evaluate_ranking(index, queries, targets, k=10):
+    '''
+    Returns the mean reciprocal rank (MRR@k), recall@1 and recall@k of the target rows for the queries.
+    '''
+    _, indices = index.search(queries, k)
+    hits = indices == targets[:, None]
+    ranks = np.where(hits.any(axis=1), hits.argmax(axis=1) + 1, np.inf)
+    return {
+        f'MRR@{k}': np.mean(1 / ranks),
+        'recall@1': np.mean(ranks <= 1),
+        f'recall@{k}': np.mean(ranks <= k)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the ranking quality of the literature index metrics.')
+    parser.add_argument('--literature', default='./data/wildfire_literature.csv.gz')
+    parser.add_argument('--embeddings', default=EMBEDDINGS_PATH)
+    parser.add_argument('--index_type', default='flat', help='Index type to evaluate for both metrics')
+    parser.add_argument('--n_queries', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.literature)
+    document_embeddings = load_embeddings(args.embeddings)
+    model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
+
+    rng = np.random.default_rng(0)
+    targets = rng.choice(len(df), min(args.n_queries, len(df)), replace=False)
+    query_embeddings = model.encode(df['title'].iloc[targets].fillna('').tolist(), batch_size=64, show_progress_bar=True).astype(np.float32)
+
+    results = {}
+    for metric in METRICS:
+        index = build_index(document_embeddings, args.index_type, metric=metric)
+        queries = normalize_embeddings(query_embeddings) if metric == 'cosine' else query_embeddings
+        results[metric] = evaluate_ranking(index, queries, targets, args.k)
+
+    print(f"Title -> paper self-retrieval over {len(targets)} papers ({args.index_type} index)")
+    print(pd.DataFrame(results).T.round(4).to_string())
@@ -1,14 +1,175 @@
-import faiss
-import numpy as np
+import os
+import gzip
+import time
 import pickle
+import argparse
+import numpy as np
+import faiss
+
+# Index types that can be built from the document embeddings; 'flat' is the exact brute-force search and
+# 'flat_fp16' stores the vectors as float16, halving the memory
+INDEX_TYPES = ('flat', 'flat_fp16', 'ivf_flat', 'ivf_pq', 'hnsw')
+# 'l2' ranks by Euclidean distance between the raw embeddings; 'cosine' L2-normalizes the embeddings and the
+# queries and ranks by inner product, i.e. cosine similarity, which all-MiniLM-L6-v2 is trained for
+METRICS = ('l2', 'cosine')
+EMBEDDINGS_PATH = './data/document_embeddings.pkl'
+INDEX_DIR = './data'
+
+
+def get_index_filename(index_type='flat', metric='l2'):
+    # The flat L2 index keeps its historical name
+    if index_type == 'flat' and metric == 'l2':
+        return 'wildfire_index.bin'
+    return f"wildfire_index_{index_type}{'_cosine' if metric == 'cosine' else ''}.bin"
+
+def normalize_embeddings(embeddings):
+    '''
+    Returns an L2-normalized float32 copy of the embeddings, as the cosine indexes and their queries need.
+    '''
+    embeddings = np.array(embeddings, dtype=np.float32)
+    faiss.normalize_L2(embeddings)
+    return embeddings
+
+def load_embeddings(path=EMBEDDINGS_PATH):
+    '''
+    Loads the document embeddings written by embedding.py (pickled, optionally gzipped) as float32 for FAISS.
+    '''
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return pickle.load(f).astype(np.float32)
+
+def get_default_nlist(n_vectors):
+    # About 4 * sqrt(n) inverted lists, with at least 39 training vectors per list as FAISS recommends
+    return int(max(1, min(4 * np.sqrt(n_vectors), n_vectors // 39)))
+
+def build_index(embeddings, index_type='flat', metric='l2', nlist=None, pq_m=48, pq_bits=8, hnsw_m=32, ef_construction=200):
+    '''
+    Builds a FAISS index over the embeddings; vector ids are the row numbers, as in the flat index.
+
+    Parameters:
+    - embeddings: float32 array with one row per document.
+    - index_type: One of INDEX_TYPES.
+    - metric: One of METRICS; with 'cosine' the embeddings are normalized here, and queries must be normalized
+      with normalize_embeddings.
+    - nlist: Number of inverted lists of the IVF indexes; see get_default_nlist by default.
+    - pq_m, pq_bits: Sub-quantizers and bits per sub-quantizer of IVF-PQ; pq_m must divide the dimension.
+    - hnsw_m, ef_construction: Graph degree and construction beam width of HNSW.
+    '''
+    if metric == 'cosine':
+        embeddings = normalize_embeddings(embeddings)
+        metric_type = faiss.METRIC_INNER_PRODUCT
+    elif metric == 'l2':
+        metric_type = faiss.METRIC_L2
+    else:
+        raise ValueError(f"Unknown metric {metric}; expected one of {METRICS}")
+
+    d = embeddings.shape[1]  # Dimension of vectors
+    if index_type == 'flat':
+        index = faiss.IndexFlat(d, metric_type)
+    elif index_type == 'flat_fp16':
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, metric_type)
+    elif index_type in ('ivf_flat', 'ivf_pq'):
+        nlist = nlist or get_default_nlist(len(embeddings))
+        quantizer = faiss.IndexFlat(d, metric_type)
+        if index_type == 'ivf_flat':
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, metric_type)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, pq_bits, metric_type)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(d, hnsw_m, metric_type)
+        index.hnsw.efConstruction = ef_construction
+    else:
+        raise ValueError(f"Unknown index type {index_type}; expected one of {INDEX_TYPES}")
+
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+def set_search_parameters(index, nprobe=None, ef_search=None):
+    '''
+    Sets the speed/recall trade-off of an ANN index: nprobe (inverted lists visited) for IVF indexes and
+    efSearch (search beam width) for HNSW. Parameters that do not apply to the index are ignored.
+    '''
+    parameters = faiss.ParameterSpace()
+    if nprobe is not None and faiss.try_extract_index_ivf(index) is not None:
+        parameters.set_index_parameter(index, 'nprobe', nprobe)
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        parameters.set_index_parameter(index, 'efSearch', ef_search)
+    return index
+
+def evaluate_index(index, ground_truth, queries, k=10, repeat=3):
+    '''
+    Measures an index against the exact neighbours in ground_truth (from the flat index).
+    Returns recall@k, the mean latency of single-query searches in milliseconds and the serialized size in MB.
+    '''
+    _, indices = index.search(queries, k)
+    recall = np.mean([len(np.intersect1d(found, expected)) / k for found, expected in zip(indices, ground_truth)])
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query[None, :], k)
+        timings.append((time.perf_counter() - start) / len(queries))
+
+    size_mb = faiss.serialize_index(index).nbytes / 1024 / 1024
+    return recall, min(timings) * 1000, size_mb
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the literature search index, or compare ANN index types against the exact one.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Build and save one index')
+    build_parser.add_argument('--index_type', choices=INDEX_TYPES, default='flat')
+
+    tune_parser = subparsers.add_parser('tune', help='Report recall@k, latency and size of the approximate indexes')
+    tune_parser.add_argument('--index_types', nargs='*', choices=INDEX_TYPES[1:], default=list(INDEX_TYPES[1:]))
+    tune_parser.add_argument('--k', type=int, default=10)
+    tune_parser.add_argument('--n_queries', type=int, default=500, help='Documents used as queries')
+    tune_parser.add_argument('--nprobe', type=int, nargs='*', default=[1, 4, 16, 64])
+    tune_parser.add_argument('--ef_search', type=int, nargs='*', default=[16, 64, 256])
+
+    for subparser in (build_parser, tune_parser):
+        subparser.add_argument('--metric', choices=METRICS, default='l2')
+        subparser.add_argument('--embeddings', default=EMBEDDINGS_PATH)
+        subparser.add_argument('--nlist', type=int, default=None)
+        subparser.add_argument('--pq_m', type=int, default=48)
+        subparser.add_argument('--hnsw_m', type=int, default=32)
+    args = parser.parse_args()
 
-# Convert embeddings to float32 for FAISS
-document_embeddings = pickle.load(open('./data/document_embeddings.pkl', 'rb'))
-document_embeddings = document_embeddings.astype(np.float32)
+    document_embeddings = load_embeddings(args.embeddings)
+    build_args = dict(metric=args.metric, nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m)
 
-# Initialize FAISS index
-d = document_embeddings.shape[1]  # Dimension of vectors
-index = faiss.IndexFlatL2(d)  # Using the L2 distance metric
-index.add(document_embeddings)  # Add vectors to the index
-faiss.write_index(index, './data/wildfire_index.bin')
+    if args.command == 'build':
+        index = build_index(document_embeddings, args.index_type, **build_args)
+        output_path = os.path.join(INDEX_DIR, get_index_filename(args.index_type, args.metric))
+        faiss.write_index(index, output_path)
+        print(f"✅ Wrote the {args.index_type} ({args.metric}) index of {index.ntotal} documents to {output_path}")
+    else:
+        rng = np.random.default_rng(0)
+        queries = document_embeddings[rng.choice(len(document_embeddings), min(args.n_queries, len(document_embeddings)), replace=False)]
+        if args.metric == 'cosine':
+            queries = normalize_embeddings(queries)
+        flat_index = build_index(document_embeddings, 'flat', metric=args.metric)
+        _, ground_truth = flat_index.search(queries, args.k)
 
+        recall, latency, size_mb = evaluate_index(flat_index, ground_truth, queries, args.k)
+        print(f"Metric: {args.metric}")
+        print(f"{'index':<10} {'setting':<14} {'recall@' + str(args.k):>9} {'ms/query':>9} {'size MB':>8}")
+        print(f"{'flat':<10} {'':<14} {recall:>9.3f} {latency:>9.3f} {size_mb:>8.1f}")
+        for index_type in args.index_types:
+            start = time.perf_counter()
+            index = build_index(document_embeddings, index_type, **build_args)
+            print(f"⏳ Built {index_type} in {time.perf_counter() - start:.1f} s")
+            if index_type.startswith('ivf'):
+                settings = [(f'nprobe={value}', dict(nprobe=value)) for value in args.nprobe]
+            elif index_type == 'hnsw':
+                settings = [(f'efSearch={value}', dict(ef_search=value)) for value in args.ef_search]
+            else:
+                settings = [('', {})]
+            for setting, parameters in settings:
+                set_search_parameters(index, **parameters)
+                recall, latency, size_mb = evaluate_index(index, ground_truth, queries, args.k)
+                print(f"{index_type:<10} {setting:<14} {recall:>9.3f} {latency:>9.3f} {size_mb:>8.1f}")